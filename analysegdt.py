@@ -6,6 +6,9 @@
 #
 # Description: Analyse GDT parameter combinations.
 # Usage: ./analysegdt.py [parameter file] -d [path to data dir]
+# With --stepwise, columns are selected stepwise instead.
+# Results are written to result.txt and to a results store
+# (results_*.npy), see gdtresults.py.
 # ToDo: Specify output file name.
 #
 # Author: Yuki Koyanagi
@@ -13,12 +16,17 @@
 #
 
 import gdtprocessor
+import gdtresults
 import argparse
+import multiprocessing
 from collections import namedtuple
 from operator import itemgetter
 
 Param = namedtuple('Param', 'avals, nvals')
 
+# (Gdtprocessor, engine, cv, nboot) in worker processes
+_worker = None
+
 
 def parseparams(p):
     """
@@ -69,61 +77,179 @@ def getcount(lst, pt):
 
 
 def tofile(t, dir):
-    transtable = str.maketrans('', '', '[] ')
+    s = []
     for r in t:
-        try:
-            s.append('#'*40)
-        except NameError:
-            s = ['#'*40]
-        s.append('Results for parameter combination:')
-        s.append('a={};n={}'.format(str(r[0]).translate(transtable),
-                                    str(r[1]).translate(transtable)))
-        s.append('')
-        for i, c in enumerate(r[2][0].tolist()):
-            s.append('a{}\t{}'.format(i, c))
-        s.append('')
-        s.append('Sum of squared residuals: '
-                 '{}'.format(r[2][1].tolist()))
-        s.append('Rank of matrix: {}'.format(r[2][2]))
-        s.append('')
-        s.append('Deviation from max GDT')
-        for row in r[3]:
-            s.append('\t'.join(['{:.2f}'.format(item)
-                                if isinstance(item, float)
-                                else item.decode('utf-8')
-                                for item in row]))
-        s.append('')
-        s.append('Guesses within given %-pt of max. GDT')
-        s.append('2%-pt\t{}({:.2f}%)'.format(
-            *getcount(r[3], 2)))
-        s.append('10%-pt\t{}({:.2f}%)'.format(
-            *getcount(r[3], 10)))
+        s.extend(totext(r))
+    with open(dir + '/result.txt', 'w') as f:
+        f.write('\n'.join(s))
+
+
+def totext(r):
+    """
+    Returns the lines of result.txt for the results r of one
+    parameter combination.
+    """
+    transtable = str.maketrans('', '', '[] ')
+    s = ['#'*40]
+    s.append('Results for parameter combination:')
+    s.append('a={};n={}'.format(str(r[0]).translate(transtable),
+                                str(r[1]).translate(transtable)))
+    s.append('')
+    for i, c in enumerate(r[2][0].tolist()):
+        s.append('a{}\t{}'.format(i, c))
+    s.append('')
+    s.append('Sum of squared residuals: '
+             '{}'.format(r[2][1].tolist()))
+    s.append('Rank of matrix: {}'.format(r[2][2]))
+    s.append('')
+    s.append('Deviation from max GDT')
+    for row in r[3]:
+        s.append('\t'.join(['{:.2f}'.format(item)
+                            if isinstance(item, float)
+                            else item.decode('utf-8')
+                            for item in row]))
+    s.append('')
+    s.append('Guesses within given %-pt of max. GDT')
+    s.append('2%-pt\t{}({:.2f}%)'.format(
+        *getcount(r[3], 2)))
+    s.append('10%-pt\t{}({:.2f}%)'.format(
+        *getcount(r[3], 10)))
+    s.append('')
+    s.append('for max. GDT > 40 only')
+    s.append('2%-pt\t{}({:.2f}%)'.format(
+        *getcount([row for row in r[3] if row[2] > 40], 2)))
+    s.append('10%-pt\t{}({:.2f}%)'.format(
+        *getcount([row for row in r[3] if row[2] > 40], 10)))
+    s.append('')
+    if len(r) > 4 and r[4] is not None:
+        press, cvev = r[4]
+        s.append('Cross-validated (leave one target out)')
+        s.append('Sum of squared residuals: {}'.format(press))
+        s.append('2%-pt\t{}({:.2f}%)'.format(*getcount(cvev, 2)))
+        s.append('10%-pt\t{}({:.2f}%)'.format(*getcount(cvev, 10)))
         s.append('')
-        s.append('for max. GDT > 40 only')
-        s.append('2%-pt\t{}({:.2f}%)'.format(
-            *getcount([row for row in r[3] if row[2] > 40], 2)))
-        s.append('10%-pt\t{}({:.2f}%)'.format(
-            *getcount([row for row in r[3] if row[2] > 40], 10)))
+    if len(r) > 5 and r[5] is not None:
+        s.append('Bootstrap 95% intervals (resampling targets)')
+        for i, (lo, hi) in enumerate(zip(*r[5])):
+            s.append('a{}\t{}\t{}'.format(i, lo, hi))
         s.append('')
-    with open(dir + '/result.txt', 'w') as f:
+    return s
+
+
+def stepwisetofile(gp, cols, hits, history, dir):
+    s = ['Stepwise selection']
+    for step, c, h in history:
+        s.append('{}{}\t2%-pt {}\t10%-pt {}'.format(step, gp.colname(c),
+                                                     *h))
+    s.append('')
+    s.append('Selected columns')
+    s.extend(gp.colname(c) for c in cols)
+    s.append('')
+    s.append('Guesses within given %-pt of max. GDT')
+    s.append('2%-pt\t{}'.format(hits[0]))
+    s.append('10%-pt\t{}'.format(hits[1]))
+    with open(dir + '/stepwise.txt', 'w') as f:
         f.write('\n'.join(s))
 
 
-def run(p, d):
+def runstepwise(p, d, cache=True, maxcols=None):
+    """
+    Stepwise selection (see Gdtprocessor.stepwise) over all columns
+    of the a and n values in param file p.
+    """
+    uparam = filestoload(parseparams(p))
+    gp = gdtprocessor.Gdtprocessor(dir=d,
+                                   arange=uparam.avals,
+                                   nrange=uparam.nvals,
+                                   cache=cache)
+    cols, hits, history = gp.stepwise(maxcols=maxcols)
+    stepwisetofile(gp, cols, hits, history, d)
+
+
+def initworker(gp, engine, cv=False, nboot=0):
+    """
+    Pool initializer. Stores the shared arguments of runparam() in
+    the worker process.
+    """
+    global _worker
+    _worker = (gp, engine, cv, nboot)
+
+
+def runparam(param):
+    """
+    Runs least square analysis for param, using the Gdtprocessor
+    set by initworker(). Returns a tuple
+    (avals, nvals, result, evaluation, cv, boot), where cv is None,
+    or (sum of sqr of CV residuals, evaluation of CV prediction) with
+    cross-validation, and boot is None, or the (lower, upper) 95%
+    bootstrap bounds of the solution with nboot > 0.
+    """
+    gp, engine, cv, nboot = _worker
+    avals, nvals = param
+    result, prediction = gp.runlstsq(avals, nvals, engine)
+    evaluation = sorted(gp.evaluate(prediction),
+                        key=itemgetter(0))
+    if cv:
+        press, cvprediction = gp.runcv(avals, nvals, engine)
+        cv = (press, sorted(gp.evaluate(cvprediction),
+                            key=itemgetter(0)))
+    else:
+        cv = None
+    boot = None
+    if nboot:
+        # Fixed seed, so results do not depend on the worker
+        boot = gp.bootstrap(avals, nvals, nboot, seed=0,
+                            engine=engine)[:2]
+    return (avals, nvals, result, evaluation, cv, boot)
+
+
+def run(p, d, cache=True, engine='lstsq', workers=1, text=True,
+        cv=False, nboot=0):
+    """
+    Runs least square analysis for each combination in param file p
+    on the data in dir d. Results are written one combination at a
+    time to the results store in d (see gdtresults.Resultwriter) and,
+    with text, to d/result.txt. With cv, leave-one-target-out
+    cross-validated hits are reported as well (see
+    Gdtprocessor.runcv). With nboot > 0, result.txt also has 95%
+    bootstrap intervals of the solution from nboot replicates (see
+    Gdtprocessor.bootstrap).
+    """
     params = parseparams(p)
     uparam = filestoload(params)
     gp = gdtprocessor.Gdtprocessor(dir=d,
                                    arange=uparam.avals,
-                                   nrange=uparam.nvals)
-    for avals, nvals in params:
-        result, prediction = gp.runlstsq(avals, nvals)
-        evaluation = sorted(gp.evaluate(prediction),
-                            key=itemgetter(0))
-        try:
-            t.append((avals, nvals, result, evaluation))
-        except NameError:
-            t = [(avals, nvals, result, evaluation)]
-    tofile(t, d)
+                                   nrange=uparam.nvals,
+                                   cache=cache)
+    if engine == 'gram':
+        gp.gram()  # computed once, before any workers are forked
+    if workers > 1:
+        # Workers are forked with gp, so the data array (a read-only
+        # memmap when cached) is shared rather than copied. Results
+        # come back in param file order.
+        chunksize = max(1, len(params) // (workers * 4))
+        pool = multiprocessing.Pool(workers, initializer=initworker,
+                                    initargs=(gp, engine, cv, nboot))
+        results = pool.imap(runparam, params, chunksize)
+    else:
+        pool = None
+        initworker(gp, engine, cv, nboot)
+        results = (runparam(param) for param in params)
+    writer = gdtresults.Resultwriter(d, params)
+    outf = open(d + '/result.txt', 'w') if text else None
+    try:
+        for i, r in enumerate(results):
+            writer.add(r)
+            if text:
+                # Same as tofile(): blocks joined by newlines
+                outf.write(('\n' if i else '') + '\n'.join(totext(r)))
+    finally:
+        writer.close()
+        if text:
+            outf.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -136,5 +262,43 @@ if __name__ == '__main__':
                         help='Directory containing '
                         'data_a#_n#.txt files.',
                         default='/home/qgm/QGM/GDT/out/linfit')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not read or write the cached data '
+                        'array (gdtcube_*.npy) in the data dir. '
+                        'Each set of a and n values has its own '
+                        'cache; old ones are not removed.')
+    parser.add_argument('--engine', choices=['lstsq', 'gram'],
+                        default='lstsq',
+                        help='Least square solver: np.linalg.lstsq per '
+                        'parameter combination, or Cholesky on the '
+                        'Gram matrix of all parameters computed once '
+                        '(see Gdtprocessor.gramlstsq). Default: lstsq')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes. Default: 1')
+    parser.add_argument('--stepwise', action='store_true',
+                        help='Instead of the given combinations, '
+                        'select columns of all their a and n values '
+                        'by stepwise selection. Writes stepwise.txt.')
+    parser.add_argument('--max-cols', type=int, default=None,
+                        help='Max. number of columns selected by '
+                        '--stepwise. Default: no limit')
+    parser.add_argument('--no-text', action='store_true',
+                        help='Write only the results store '
+                        '(results_*.npy, see gdtresults.py), '
+                        'not result.txt.')
+    parser.add_argument('--cv', action='store_true',
+                        help='Also report leave-one-target-out '
+                        'cross-validated hits.')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        metavar='N',
+                        help='Also report 95%% intervals of the '
+                        'coefficients from N bootstrap replicates, '
+                        'resampling targets. Default: 0 (none)')
     args = parser.parse_args()
-    run(args.paramfile, args.data_dir)
+    if args.stepwise:
+        runstepwise(args.paramfile, args.data_dir, not args.no_cache,
+                    args.max_cols)
+    else:
+        run(args.paramfile, args.data_dir, not args.no_cache,
+            args.engine, args.workers, not args.no_text, args.cv,
+            args.bootstrap)
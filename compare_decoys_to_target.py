@@ -4,77 +4,70 @@
 # File: compare_decoys_to_target.py
 # Author: Rasmus Villemoes
 
+# Computes P and S_n scores of decoys w.r.t. their targets. Run as a
+# script it writes one tab-separated row per decoy (or a .npy table,
+# see --output-template). Imported, score_target() returns the scores
+# of one target's decoys as a numpy structured array with the same
+# columns, see dtype.
 
 import sys
 import os
 import platform
 import itertools
 import math
+import multiprocessing
+from collections import namedtuple
 
 import string
 import gc
 import re
 
+import numpy as np
+
 sys.path.append("/home/qgm/QGM/cdp")
 
 from cdp import *
+import protcache
+import protarchive
 
-from argparse import ArgumentParser
-parser = ArgumentParser()
-
-parser.add_argument("files", nargs='*')
-parser.add_argument("--decoy-dir", type=str,
-                    help="directory containing decoys corresponding to the given targets")
-
-parser.add_argument("--tert-dir", type=str,
-                    help="directory containing tertiary information for targets and decoys")
-
-parser.add_argument("--gdt-file", type=str,
-                    help="file with gdt scores for decoys")
-
-parser.add_argument("--const", type=float,
-                    help="constant for use in bond_set_score")
-
-parser.add_argument("--nconst", type=int,
-                    help="another constant for use in bond_set_score")
-
-parser.add_argument("--Calpha-max", type=float, default=float('inf'),
-                    help="cutoff for Calpha distance, default infinity")
-
-parser.add_argument("--Cbeta-max", type=float, default=float('inf'),
-                    help="cutoff for Cbeta distance, default infinity")
+default_decoy_dir = "/home/qgm/QGM/GDT/data/casp10/decoys/split"
+default_tert_dir = "/home/qgm/QGM/tertiary/data/20151102/casp10"
+default_gdt_file = "/home/qgm/QGM/GDT/data/casp10/summaries/gdt_ts.txt"
 
+# Scoring parameters. tert_dir is the directory of tertiary files, or
+# None to score without tertiary bonds (the default_* dirs are only
+# used by the script), gdt is a dict {decoy name: gdt score}, nconsts
+# a list of values of nconst to score for, and cache_dir the
+# protcache directory or None.
+Params = namedtuple('Params', 'tert_dir gdt nconsts const '
+                    'Calpha_max Cbeta_max cache_dir')
 
 
-args = parser.parse_args()
-decoy_dir = args.decoy_dir
-if decoy_dir is None:
-    decoy_dir = "/home/qgm/QGM/GDT/data/casp10/decoys/split"
+def make_params(tert_dir=None, gdt=None, nconsts=(5,),
+                const=0.0, Calpha_max=float('inf'),
+                Cbeta_max=float('inf'), cache_dir=None):
+    if gdt is None:
+        gdt = {}
+    return Params(tert_dir, gdt, list(nconsts), const,
+                  Calpha_max, Cbeta_max, cache_dir)
 
-tert_dir = args.tert_dir
-if tert_dir is None:
-    tert_dir = "/home/qgm/QGM/tertiary/data/20151102/casp10"
 
+# Columns of an output row, in order: names, gdt score, then
+# (target bonds, decoy bonds, P, S2, S) for H-bonds and for tertiary
+# bonds.
+dtype = np.dtype([('target', 'S16'), ('decoy', 'S32'), ('gdt', float),
+                  ('H_target', float), ('H_decoy', float),
+                  ('H_P', float), ('H_S2', float), ('H_S', float),
+                  ('T_target', float), ('T_decoy', float),
+                  ('T_P', float), ('T_S2', float), ('T_S', float)])
 
-gdt_file = args.gdt_file
-if gdt_file is None:
-    gdt_file = "/home/qgm/QGM/GDT/data/casp10/summaries/gdt_ts.txt"
 
-GDT = dict()
-for l in open(gdt_file):
-    d, gdt = l.strip().split()
-    GDT[d] = float(gdt)
-
-const = args.const
-if const is None:
-    const = 0.0
-
-nconst = args.nconst
-if nconst is None:
-    nconst = 5
-
-Calpha_max = args.Calpha_max
-Cbeta_max = args.Cbeta_max
+def read_gdt(gdt_file):
+    GDT = dict()
+    for l in open(gdt_file):
+        d, gdt = l.strip().split()
+        GDT[d] = float(gdt)
+    return GDT
 
 
 def pdist(a, b):
@@ -82,7 +75,7 @@ def pdist(a, b):
 
 
 # This is NOT a distance. Larger means better. So it is more like 'score'.
-def bond_set_score(b, S):
+def bond_set_score(b, S, nconst=5, const=0.0):
     def f(x):
         x = abs(x)
         if x > 2*nconst:
@@ -107,76 +100,350 @@ def bond_set_score(b, S):
     return math.exp(-const * dist)
 
 
-def set_scores(target_set, decoy_set):
-    common_set = target_set & decoy_set
+# Maximum number of bond pairs scored at once by bond_set_scores
+pair_block = 1 << 20
 
-    if len(target_set) == 0:
-        P1 = 100  # kludge, but what else should we set 0/0 to?
-    else:
-        P1 = float(len(common_set))/float(len(target_set)) * 100
 
-    S2 = 0
-    S2 += sum([bond_set_score(b, decoy_set - common_set) for b in target_set - common_set])
-    S2 += sum([bond_set_score(b, target_set - common_set) for b in decoy_set - common_set])
-    if (len(target_set - common_set) + len(decoy_set - common_set)):
-        S2 /= (len(target_set - common_set) + len(decoy_set - common_set))
-    else:
-        assert(S2 == 0)
+# Vectorised bond_set_score: returns a list with bond_set_score(b, S)
+# for each bond b in B. Bonds are (donor, acceptor) pairs.
+def bond_set_scores(B, S, nconst=5):
+    return bond_set_scores_multi(B, S, [nconst])[0]
 
-    S = P1 + S2*(100-P1)
-    return len(target_set), len(decoy_set), P1, S2, S
 
+# bond_set_scores for several values of nconst at once: returns one
+# list of scores per value in ns.
+def bond_set_scores_multi(B, S, ns):
+    if len(S) == 0:
+        return [[-1] * len(B) for n in ns]
+    B = np.array(list(B), dtype=np.int64).reshape(-1, 2)
+    S = np.array(list(S), dtype=np.int64).reshape(-1, 2)
+    n = np.array(ns, dtype=float)[:, None, None]
 
-decoy_files = sorted(os.listdir(decoy_dir))
+    def f(x):
+        return np.where(x > 2*n, -1.0, 1 - x/n)
+
+    scores = np.empty((len(ns), len(B)))
+    far = np.empty((len(ns), len(B)), dtype=bool)
+    step = max(1, pair_block // (len(S) * len(ns)))
+    for i in range(0, len(B), step):
+        b = B[i:i+step, None, :]
+        dx = np.abs(b[..., 0] - S[:, 0])
+        dy = np.abs(b[..., 1] - S[:, 1])
+        v = f(dx) + f(dy)
+        j = v.argmax(axis=2)  # first best pair, as max() picks
+        k, rows = np.indices(j.shape)
+        scores[:, i:i+step] = v[k, rows, j]
+        far[:, i:i+step] = ((dx[rows, j] > 2*n[:, 0]) &
+                            (dy[rows, j] > 2*n[:, 0]))
+    # bond_set_score gives the int -2 when the best pair is out of
+    # range at both ends; keep that so output is unchanged
+    return [[-2 if isfar else x for x, isfar in zip(sc, fa)]
+            for sc, fa in zip(scores.tolist(), far.tolist())]
+
+
+def set_scores(target_set, decoy_set, nconst=5):
+    return set_scores_multi(target_set, decoy_set, [nconst])[0]
+
+
+# set_scores for several values of nconst at once: returns one tuple
+# per value in ns.
+def set_scores_multi(target_set, decoy_set, ns):
+    common_set = target_set & decoy_set
 
-for f in args.files:
-    base, ext = os.path.splitext(os.path.basename(f))
-    target = Protein(name=base)
-    target.from_file(f)
+    if len(target_set) == 0:
+        P1 = 100  # kludge, but what else should we set 0/0 to?
+    else:
+        P1 = float(len(common_set))/float(len(target_set)) * 100
 
-    if tert_dir:
-        tfile = tert_dir + "/" + os.path.basename(f)
+    T_only = list(target_set - common_set)
+    D_only = list(decoy_set - common_set)
+    TD = bond_set_scores_multi(T_only, D_only, ns)
+    DT = bond_set_scores_multi(D_only, T_only, ns)
+    res = []
+    for k in range(len(ns)):
+        S2 = 0
+        S2 += sum(TD[k])
+        S2 += sum(DT[k])
+        if (len(T_only) + len(D_only)):
+            S2 /= (len(T_only) + len(D_only))
+        else:
+            assert(S2 == 0)
+
+        S = P1 + S2*(100-P1)
+        res.append((len(target_set), len(decoy_set), P1, S2, S))
+    return res
+
+
+def load_protein(name, path, fname, params, cached=True):
+    # fname is the file name used to find tertiary information; path
+    # may be a temporary copy of an archive member, which should not
+    # be cached.
+    prot = Protein(name=name)
+    protcache.from_file(prot, path, params.cache_dir if cached else None)
+
+    if params.tert_dir:
+        tfile = params.tert_dir + "/" + fname
         try:
-            target.add_tertiary_interactions(tfile, Calpha_max_dist = Calpha_max, Cbeta_max_dist = Cbeta_max)
+            protcache.add_tertiary_interactions(prot, tfile, params.cache_dir, Calpha_max_dist = params.Calpha_max, Cbeta_max_dist = params.Cbeta_max)
         except Exception as e:
-            # sys.stderr.write("Failed to add tertiary interaction info for %s: %s\n" % (base, e))
+            # sys.stderr.write("Failed to add tertiary interaction info for %s: %s\n" % (name, e))
             pass
+    return prot
 
+
+def compare(base, target, decoys, params, cached=True):
+    # decoys is an iterable of (file name, path) pairs. Yields, for
+    # each decoy, a list of output rows (tuples of values in the
+    # order of dtype) per value in params.nconsts.
     T_Hbonds = set([(hb.donor, hb.accptr) for hb in target.Hbonds])
     T_Tbonds = set([(tb.donor, tb.accptr) for tb in target.Tbonds])
     # print T_Tbonds
 
-    for d in decoy_files:
+    for d, path in decoys:
         if d.endswith(".txt") and d.startswith(base):
             dbase, dext = os.path.splitext(d)
-            decoy = Protein(name=dbase)
-            decoy.from_file(decoy_dir + "/" + d)
+            decoy = load_protein(dbase, path, d, params, cached)
 
-            if dbase in GDT:
-                gdt = GDT[dbase]
+            if dbase in params.gdt:
+                gdt = params.gdt[dbase]
             else:
                 gdt = float('nan')
 
-            if tert_dir:
-                tfile = tert_dir + "/" + os.path.basename(d)
-                try:
-                    decoy.add_tertiary_interactions(
-                        tfile,
-                        Calpha_max_dist=Calpha_max,
-                        Cbeta_max_dist=Cbeta_max)
-                except Exception as e:
-                    # sys.stderr.write("Failed to add tertiary interaction info for %s: %s\n" % (dbase, e))
-                    pass
-
             D_Hbonds = set([(hb.donor, hb.accptr) for hb in decoy.Hbonds])
             D_Tbonds = set([(tb.donor, tb.accptr) for tb in decoy.Tbonds])
 
-            T_Hcount, D_Hcount, H_P1, H_S2, H_S = set_scores(T_Hbonds, D_Hbonds)
-            T_Tcount, D_Tcount, T_P1, T_S2, T_S = set_scores(T_Tbonds, D_Tbonds)
-
+            H_scores = set_scores_multi(T_Hbonds, D_Hbonds, params.nconsts)
+            T_scores = set_scores_multi(T_Tbonds, D_Tbonds, params.nconsts)
+
+            yield [(base, dbase, gdt) + H + T
+                   for H, T in zip(H_scores, T_scores)]
+
+
+def to_array(rows):
+    # Structured array (of dtype) from a list of output rows
+    return np.array(rows, dtype=dtype)
+
+
+def score_target(target_path, decoys, params):
+    """
+    Scores the decoys of the target file target_path. decoys is a
+    directory, or an iterable of (file name, path) pairs. Returns a
+    structured array of dtype with shape (len(params.nconsts),
+    number of decoys); row k holds the scores for params.nconsts[k].
+    """
+    fname = os.path.basename(target_path)
+    base, ext = os.path.splitext(fname)
+    cached = True
+    if isinstance(decoys, str):
+        # temporary copies of archive members are not cached
+        cached = not protarchive.isarchive(decoys)
+        decoys = protarchive.files(decoys)
+    target = load_protein(base, target_path, fname, params)
+    res = np.empty((len(params.nconsts), 0), dtype=dtype)
+    rows = list(compare(base, target, decoys, params, cached))
+    if rows:
+        res = to_array(rows).T
+    return res
+
+
+def target_files(paths, params):
+    # Yields (file name, path, cached) for target files, expanding
+    # archives. Temporary copies of archive members are not cached.
+    for f in paths:
+        if protarchive.isarchive(f):
+            for fname, path in protarchive.files(f):
+                yield fname, path, False
+        else:
+            yield os.path.basename(f), f, True
+
+
+def load_targets(paths, params):
+    for fname, path, cached in target_files(paths, params):
+        base, ext = os.path.splitext(fname)
+        yield base, load_protein(base, path, fname, params, cached)
+
+
+def member_files(members):
+    # Yields (file name, path) for (file name, contents) pairs of
+    # archive members; each path is valid until the next is requested.
+    for name, data in members:
+        with protarchive.asfile(name, data) as path:
+            yield name, path
+
+
+def target_tasks(paths):
+    # Yields one task per target file for target_rows. Archive members
+    # are passed by contents, as their temporary files do not outlive
+    # the iteration.
+    for f in paths:
+        if protarchive.isarchive(f):
+            for member in protarchive.members(f):
+                yield member
+        else:
+            yield os.path.basename(f), f, True
+
+
+# (params, decoy dir, sorted decoy file names or None, {target name:
+# target} or None) for target_rows and group_rows
+_worker = None
+
+
+def initworker(params, decoy_dir, decoy_files=None, targets=None):
+    global _worker
+    _worker = (params, decoy_dir, decoy_files, targets)
+
+
+def target_rows(task):
+    # Returns the rows of all decoys in the decoy dir for one target,
+    # given as (file name, path, cached) or as archive member
+    # (file name, contents).
+    if len(task) == 2:
+        for fname, path in member_files([task]):
+            return target_rows((fname, path, False))
+    params, decoy_dir, decoy_files, targets = _worker
+    fname, path, cached = task
+    base, ext = os.path.splitext(fname)
+    target = load_protein(base, path, fname, params, cached)
+    return list(compare(base, target,
+                        ((d, decoy_dir + "/" + d) for d in decoy_files),
+                        params))
+
+
+def group_rows(task):
+    # Returns the rows for (target name, list of decoy archive members)
+    params, decoy_dir, decoy_files, targets = _worker
+    base, members = task
+    return list(compare(base, targets[base], member_files(members),
+                        params, False))
+
+
+def run_tasks(f, tasks, jobs, initargs):
+    # Yields f(task) for each task in order. With jobs > 1 the tasks
+    # are run in a pool of forked worker processes, which get the
+    # shared state from initworker(*initargs).
+    if jobs <= 1:
+        initworker(*initargs)
+        for task in tasks:
+            yield f(task)
+        return
+    pool = multiprocessing.Pool(jobs, initializer=initworker,
+                                initargs=initargs)
+    try:
+        for res in pool.imap(f, tasks):
+            yield res
+    finally:
+        pool.close()
+        pool.join()
+
+
+def all_rows(paths, decoy_dir, params, jobs=1):
+    # Yields the output rows (one per value in params.nconsts) of all
+    # decoys of the target files in paths
+    if protarchive.isarchive(decoy_dir):
+        # Read the archive in a single pass. Decoys arrive grouped by
+        # target, so all targets are loaded first.
+        targets = dict(load_targets(paths, params))
+        tasks = ((base, list(decoys)) for base, decoys
+                 in protarchive.groupbytarget(protarchive.members(decoy_dir))
+                 if base in targets)
+        results = run_tasks(group_rows, tasks, jobs,
+                            (params, decoy_dir, None, targets))
+    else:
+        decoy_files = sorted(os.listdir(decoy_dir))
+        results = run_tasks(target_rows, target_tasks(paths), jobs,
+                            (params, decoy_dir, decoy_files))
+    for rows in results:
+        for r in rows:
+            yield r
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument("files", nargs='*',
+                        help="target files, or tar archives of target files")
+    parser.add_argument("--decoy-dir", type=str,
+                        help="directory (or tar archive) containing decoys corresponding to the given targets")
+
+    parser.add_argument("--tert-dir", type=str,
+                        help="directory containing tertiary information for targets and decoys")
+
+    parser.add_argument("--gdt-file", type=str,
+                        help="file with gdt scores for decoys")
+
+    parser.add_argument("--const", type=float,
+                        help="constant for use in bond_set_score")
+
+    parser.add_argument("--nconst", type=int, nargs='+',
+                        help="another constant for use in bond_set_score; "
+                        "several values are computed in a single pass, see --output-template")
+
+    parser.add_argument("--Calpha-max", type=float, default=float('inf'),
+                        help="cutoff for Calpha distance, default infinity")
+
+    parser.add_argument("--Cbeta-max", type=float, default=float('inf'),
+                        help="cutoff for Cbeta distance, default infinity")
+
+    parser.add_argument("--cache-dir", type=str,
+                        help="directory for cached parsed proteins, default no cache")
+
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes, one target at a time "
+                        "each; rows are output in the same order as with one job")
+
+    parser.add_argument("--output-template", type=str,
+                        help="write the table for each nconst value n to the file "
+                        "OUTPUT_TEMPLATE.format(n=n) instead of stdout, e.g. "
+                        "'out/scores_n{n}.txt'; default 'scores_n{n}.txt' with "
+                        "several nconst values. Files ending in .npy are "
+                        "written as numpy structured arrays")
+
+    args = parser.parse_args()
+    decoy_dir = args.decoy_dir
+    if decoy_dir is None:
+        decoy_dir = default_decoy_dir
+
+    tert_dir = args.tert_dir
+    if tert_dir is None:
+        tert_dir = default_tert_dir
+
+    gdt_file = args.gdt_file
+    if gdt_file is None:
+        gdt_file = default_gdt_file
+
+    const = args.const
+    if const is None:
+        const = 0.0
+
+    nconsts = args.nconst
+    if nconsts is None:
+        nconsts = [5]
+
+    output_template = args.output_template
+    if output_template is None and len(nconsts) > 1:
+        output_template = "scores_n{n}.txt"
+
+    params = make_params(tert_dir, read_gdt(gdt_file), nconsts, const,
+                         args.Calpha_max, args.Cbeta_max, args.cache_dir)
+    rows = all_rows(args.files, decoy_dir, params, args.jobs)
+
+    if output_template is None:
+        for r in rows:
+            print "\t".join(str(x) for x in r[0])
+    elif output_template.endswith(".npy"):
+        tables = [list(t) for t in zip(*rows)]
+        for n, table in zip(nconsts, tables or [[]] * len(nconsts)):
+            np.save(output_template.format(n=n), to_array(table))
+    else:
+        # One table per nconst value, all filled in the same pass
+        outfiles = [open(output_template.format(n=n), "w") for n in nconsts]
+        for r in rows:
+            for outf, values in zip(outfiles, r):
+                outf.write("\t".join(str(x) for x in values) + "\n")
+        for outf in outfiles:
+            outf.close()
 
-            columns = [base, dbase, str(gdt)]
-            columns += [str(x) for x in [T_Hcount, D_Hcount, H_P1, H_S2, H_S]]
-            columns += [str(x) for x in [T_Tcount, D_Tcount, T_P1, T_S2, T_S]]
 
-            print "\t".join(columns)
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,8 @@
 # Description: Wrapper for cdp.py code for GDT-Graph analysis.
 # Class: Protein (inherits cdp.Protein)
 #  Attributes:
-#   residueids: (1-based) list of residue id's.
+#   resmask: boolean mask over (1-based) residue indices.
+#   residueids: (1-based) list of residue id's, backed by resmask.
 #  Methods:
 #   subgraph():
 #   addresidueids():
@@ -15,11 +16,26 @@
 #   bondexists():
 #   toresidueids():
 #   toatomids():
+#   tomask():
+#   vertexmask():
+#   nresidues():
+#   shells():
 #   grow():
+#   undo():
+#   changedresidues():
 #   addbond():
+#   removebond():
 #   bbedges():
 #   d(): static method
+# Class: EditDistance
+#  Running value of Protein.d() for a pair of growing subgraphs.
+# Class: Shells
+#  Hop distances of a graph's residues, for growing any window.
+# Seqlengths(): Indexed sequence length file, loaded once.
 # Computegdtg():
+# Computegdtg_multi(): Computegdtg() for several cut-off values
+# Computegdtg_grow(): Computegdtg_multi() by growing subgraphs,
+#  kept as reference implementation
 #
 # Usage: Needs cdp.py in the same directory. Note cdp.py uses
 # internally atom id's, which are 3-based, with the first N atom
@@ -29,15 +45,34 @@
 # History:
 #  2016-12-14: Created
 #
-import copy
+import os
+import numpy as np
 import cdp
 
+# Loaded sequence length files, {path: {target name: length}}
+_seqlengths = {}
 
-class Protein(cdp.Protein):
+
+class Protein(cdp.Protein, object):  # object: new-style, for properties
 
     def __init__(self, name):
         cdp.Protein.__init__(self, name)
-        self.residueids = None
+        self.resmask = None
+        self._vmask = (None, None)
+        self._shells = (None, None)
+
+    @property
+    def residueids(self):
+        if self.resmask is None:
+            return None
+        return np.flatnonzero(self.resmask).tolist()
+
+    @residueids.setter
+    def residueids(self, resids):
+        if resids is None:
+            self.resmask = None
+        else:
+            self.resmask = self.tomask(resids)
 
     def subgraph(self, residues):
         """
@@ -45,29 +80,33 @@ class Protein(cdp.Protein):
         containing only the residues specified.
         """
         subg = Protein(name='{}_sub'.format(self.name))
-        subg.residueids = residues
+        subg.resmask = self.tomask(residues, len(self.resmask))
         subg.addedges(self)
         return subg
 
     def addresidueids(self, seqf):
+        """
+        Sets residueids from the sequence length of this protein's
+        target, looked up in seqf. seqf is a sequence length file or
+        a dict returned by seqlengths().
+        """
         if not self.name:
             raise Exception("No name is defined for Protein.")
         name = self.name.split('_')[0]  # works also for decoys
-        with open(seqf) as seqfile:
-            for line in seqfile:
-                if name in line:
-                    maxidx = int(line.split()[1])
-                    self.residueids = range(1, maxidx+1)
+        if not isinstance(seqf, dict):
+            seqf = seqlengths(seqf)
+        if name in seqf:
+            self.residueids = range(1, seqf[name]+1)
 
     def addedges(self, supgraph):
         """
         Copy Hbonds and Tbonds from supgraph, if both endpoints are
         in the current graph.
         """
-        atomids = self.toatomids(self.residueids)
-        for idx in set(atomids) & set(supgraph.vertices.keys()):
+        atoms = np.repeat(self.resmask, 3)
+        for idx in np.flatnonzero(atoms & supgraph.vertexmask()).tolist():
             bond = supgraph.vertices[idx]
-            if (bond.other_end(idx) in atomids and
+            if (atoms[bond.other_end(idx)] and
                     not self.bondexists(bond)):
                 self.addbond(bond)
 
@@ -83,53 +122,140 @@ class Protein(cdp.Protein):
         Converts the given iterable of residue indices (1-based) to a
         list of atom indices (3(!?)-based)
         """
-        atomids = [[i*3, i*3+1, i*3+2] for i in resids]
-        return sorted(sum(atomids, []))  # flattens the list(!)
+        return sorted(a for i in resids for a in (i*3, i*3+1, i*3+2))
 
     def toresidueids(self, atomids):
         """
         Converts the given iterable of atom indices (3(!?)-based) to a
         list of residue indices (1-based)
         """
-        resids = set([i/3 for i in atomids])  # de-duplicate
+        resids = set([i // 3 for i in atomids])  # de-duplicate
         return sorted(list(resids))
 
+    def tomask(self, resids, size=None):
+        """
+        Converts the given iterable of residue indices (1-based) to a
+        boolean mask over residue indices. Unless size is given, the
+        mask covers all residues with bonds in this graph, with one
+        extra False entry at either end so that i-1 and i+1 are valid
+        indices for every residue i.
+        """
+        resids = np.array(list(resids), dtype=int)
+        if size is None:
+            size = max(resids.max() if len(resids) else 0,
+                       self.maxidx // 3) + 2
+        mask = np.zeros(size, dtype=bool)
+        mask[resids] = True
+        return mask
+
+    def vertexmask(self):
+        """
+        Returns a boolean mask over atom indices (3-based) of the
+        bond endpoints in this graph, aligned with
+        np.repeat(self.resmask, 3). The mask is cached until
+        vertices change size.
+        """
+        key = (len(self.vertices), len(self.resmask))
+        if self._vmask[0] != key:
+            mask = np.zeros(3 * len(self.resmask), dtype=bool)
+            mask[list(self.vertices)] = True
+            self._vmask = (key, mask)
+        return self._vmask[1]
+
+    def nresidues(self):
+        """
+        Returns the number of residues in this graph
+        """
+        return int(np.count_nonzero(self.resmask))
+
+    def shells(self, sources):
+        """
+        Returns Shells of this graph for the given source residues.
+        The result is cached until vertices, residue ids or sources
+        change, so a target is only searched once for all decoys.
+        """
+        key = (len(self.vertices), self.resmask.tobytes(), tuple(sources))
+        if self._shells[0] != key:
+            self._shells = (key, Shells(self, sources))
+        return self._shells[1]
+
     def grow(self, supgraph):
         """
-        Grow this graph by one edge inside supgraph
+        Grow this graph by one edge inside supgraph. Returns a tuple
+        (bonds, residue ids, (minidx, maxidx), residues) of what was
+        added in this step and of the cdp state it changed, which can
+        be passed to undo(). The bonds are this graph's copies (see
+        addbond()), so they match Protein.d().
         """
         # Collect outgoing bonds from subgraph
         # Note de-duplication as 'outgoing' bond may terminate
         # inside subgraph.
-        vs = list(set(supgraph.vertices) &
-                  set(self.toatomids(self.residueids)) -
-                  set(self.vertices))
-        outbonds = set([supgraph.vertices[i] for i in vs])
-
-        # Construct residueids post-growing
-        l = [[i-1, i, i+1] for i in self.residueids]
-        x = set(sum(l, []))  # flatten and de-duplicate
-        y = x & set(supgraph.residueids)
-        newresid = sorted(list(y))
-
-        # Now we do the actual growing
-        backup = copy.deepcopy(self)
+        atoms = np.repeat(self.resmask, 3) & supgraph.vertexmask()
+        outbonds = set([supgraph.vertices[i]
+                        for i in np.flatnonzero(atoms).tolist()
+                        if i not in self.vertices])
+
+        # Construct residueids post-growing, starting from the
+        # backbone neighbours inside supgraph
+        newmask = self.resmask.copy()
+        newmask[1:] |= self.resmask[:-1]
+        newmask[:-1] |= self.resmask[1:]
+        newmask &= supgraph.resmask
+        newmask |= self.resmask
+
+        # Now we do the actual growing, logging the added bonds so
+        # that a failed step can be rolled back
+        idx = (self.minidx, self.maxidx)
+        residues = dict(self.residues) if outbonds else self.residues
+        added = []
         try:
             for bond in outbonds:
-                self.addbond(bond)
-            # Need to add new residues at the endpoints of
-            # outgoing bonds
-            l = (set(self.vertices.keys()) |
-                 set(self.toatomids(newresid)))
-            self.residueids = self.toresidueids(l)
+                added.append(self.addbond(bond))
         except:
             # Rollback
-            self = backup
+            self.undo((added, [], idx, self.changedresidues(residues)))
             raise
+        # Need to add new residues at the endpoints of
+        # outgoing bonds
+        for bond in added:
+            newmask[bond.donor // 3] = True
+            newmask[bond.accptr // 3] = True
+        step = (added, np.flatnonzero(newmask & ~self.resmask).tolist(),
+                idx, self.changedresidues(residues))
+        self.resmask = newmask
+        return step
+
+    def changedresidues(self, old):
+        """
+        Returns {residue index: old entry} for the entries of
+        self.residues (set by cdp when adding an Hbond) which differ
+        from the dict old, with None for entries not in old.
+        """
+        if old is self.residues:
+            return {}
+        return dict((k, old.get(k)) for k, r in self.residues.items()
+                    if old.get(k) != r)
+
+    def undo(self, step):
+        """
+        Reverts a growth step, i.e. a tuple (bonds, residue ids,
+        (minidx, maxidx), residues) as returned by grow().
+        """
+        bonds, resids, idx, residues = step
+        for bond in reversed(bonds):
+            self.removebond(bond)
+        self.resmask[list(resids)] = False
+        self.minidx, self.maxidx = idx
+        for k, r in residues.items():
+            if r is None:
+                del self.residues[k]
+            else:
+                self.residues[k] = r
 
     def addbond(self, bond):
         """
-        Adds given bond (T or H) to self
+        Adds a copy of given bond (T or H) to self, and returns the
+        copy
         """
         if isinstance(bond, cdp.Hbond):
             self.add_Hbond(bond.linenumber,
@@ -145,14 +271,32 @@ class Protein(cdp.Protein):
                           bond.donor,
                           bond.accptr,
                           bond.d_VDW)
+        return self.vertices[bond.donor]
+
+    def removebond(self, bond):
+        """
+        Removes given bond (T or H), previously added with addbond(),
+        from self
+        """
+        own = self.vertices.pop(bond.donor)
+        del self.vertices[bond.accptr]
+        if isinstance(own, cdp.Hbond):
+            bonds = self.Hbonds
+        else:
+            bonds = self.Tbonds
+        # Bonds are usually removed in reverse order of addition
+        for i in range(len(bonds) - 1, -1, -1):
+            if bonds[i] is own:
+                del bonds[i]
+                break
 
     def bbedges(self):
         """
         Returns a list of backbone-edges (i, i+1) constructed from
         residueids
         """
-        return [(i, i+1) for i in self.residueids
-                if i+1 in self.residueids]
+        edges = np.flatnonzero(self.resmask[:-1] & self.resmask[1:])
+        return [(i, i+1) for i in edges.tolist()]
 
     @staticmethod
     def d(target, decoy):
@@ -168,28 +312,271 @@ class Protein(cdp.Protein):
         return len(bonds) + len(edges)
 
 
+class EditDistance(object):
+    """
+    Keeps Protein.d(target, decoy) up to date while the two subgraphs
+    grow, by looking only at the bonds and residues added in each
+    step instead of comparing the whole subgraphs again.
+    """
+
+    def __init__(self, target, decoy):
+        self.value = Protein.d(target, decoy)
+        self._bonds = (set(target.Hbonds + target.Tbonds),
+                       set(decoy.Hbonds + decoy.Tbonds))
+        self._resids = (set(target.residueids),
+                        set(decoy.residueids))
+
+    def update(self, tgrowth, dgrowth):
+        """
+        Update the distance with the steps returned by
+        Protein.grow() for target and decoy.
+        """
+        for side, step in enumerate((tgrowth, dgrowth)):
+            self.addbonds(side, step[0])
+            self.addresidues(side, step[1])
+        return self.value
+
+    def addbonds(self, side, bonds):
+        """
+        Add bonds to target (side 0) or decoy (side 1). A bond
+        already in the other graph removes a mismatch, any other
+        bond adds one.
+        """
+        own, other = self._bonds[side], self._bonds[1-side]
+        for bond in bonds:
+            if bond in own:
+                continue
+            own.add(bond)
+            self.value += -1 if bond in other else 1
+
+    def addresidues(self, side, resids):
+        """
+        Add residues to target (side 0) or decoy (side 1), counting
+        the backbone edges (i, i+1) they complete.
+        """
+        own, other = self._resids[side], self._resids[1-side]
+        for r in resids:
+            if r in own:
+                continue
+            own.add(r)
+            for i in (r-1, r):
+                if i in own and i+1 in own:
+                    self.value += (-1 if i in other and i+1 in other
+                                   else 1)
+
+
+class Shells(object):
+    """
+    Hop distances from each of a list of source residues to all
+    residues of a graph, where a hop is one Protein.grow() step:
+    along the backbone to a residue in resmask, or along an H- or
+    Tbond to the residue of its other end. Each source is searched
+    by breadth-first search over adjacency lists, in
+    O(sources * (residues + bonds)). As growing is a search from the
+    three residues of a window, its growth layers follow from the
+    distances of those three.
+    """
+
+    def __init__(self, prot, sources):
+        mask = prot.resmask
+        n = len(mask)
+        # grow() only finds bonds through vertices; cdp allows one
+        # bond per atom, so each bond is found through both its ends
+        bonds = dict((id(b), b) for b in prot.vertices.values()).values()
+        self.dres = np.array([b.donor // 3 for b in bonds], dtype=int)
+        self.ares = np.array([b.accptr // 3 for b in bonds], dtype=int)
+        inmask = mask.tolist()
+        adj = [[] for r in range(n)]
+        for r in range(n - 1):
+            if inmask[r + 1]:
+                adj[r].append(r + 1)
+            if inmask[r]:
+                adj[r + 1].append(r)
+        for d, a in zip(self.dres.tolist(), self.ares.tolist()):
+            adj[d].append(a)
+            adj[a].append(d)
+        self.index = dict((s, j) for j, s in enumerate(sources))
+        # distance n means unreachable, more than any hop count
+        self.dist = np.array([self.search(adj, s) for s in sources],
+                             dtype=int).reshape(len(sources), n)
+        self.mask = mask
+
+    @staticmethod
+    def search(adj, source):
+        """
+        Returns the list of hop distances from source in the graph
+        with adjacency lists adj, len(adj) for unreachable residues.
+        """
+        n = len(adj)
+        dist = [n] * n
+        dist[source] = 0
+        frontier = [source]
+        k = 0
+        while frontier:
+            k += 1
+            new = []
+            for r in frontier:
+                for q in adj[r]:
+                    if dist[q] == n:
+                        dist[q] = k
+                        new.append(q)
+            frontier = new
+        return dist
+
+    def distance(self, window):
+        """
+        Returns the hop distance of every residue from the residues
+        in window, which must be sources.
+        """
+        return self.dist[[self.index[r] for r in window]].min(axis=0)
+
+    def bondlevels(self, d):
+        """
+        Returns the growth step at which each bond is added to a
+        subgraph of the window with distances d: 0 if both ends are
+        in the window (Protein.subgraph()), and otherwise one step
+        after the nearer end is reached.
+        """
+        dd, da = d[self.dres], d[self.ares]
+        return np.where(np.maximum(dd, da) == 0, 0,
+                        np.minimum(dd, da) + 1)
+
+
+def seqlengths(seqf):
+    """
+    Returns a dict {target name: sequence length} for a file with
+    lines of the form 'T0644 166 residues'. Each file is read only
+    once; later calls return the same dict.
+    """
+    path = os.path.abspath(seqf)
+    if path not in _seqlengths:
+        lengths = {}
+        with open(path) as seqfile:
+            for line in seqfile:
+                cols = line.split()
+                if len(cols) > 1:
+                    lengths[cols[0]] = int(cols[1])
+        _seqlengths[path] = lengths
+    return _seqlengths[path]
+
+
 def computegdtg(target, decoy, limit):
     """
     Compute GDT-Graph score
     """
+    return computegdtg_multi(target, decoy, [limit])[0]
+
+
+def computegdtg_multi(target, decoy, cutoffs):
+    """
+    Compute GDT-Graph scores for a list of cut-off values. Each
+    window is grown only once, until the distance has exceeded every
+    cut-off, and the stopping size for each cut-off is recorded on
+    the way. Returns a list of scores in the order of cutoffs.
+    The growth of each window is read off the Shells of target and
+    decoy, which are searched once for all windows: after k steps a
+    subgraph holds the residues within k hops of the window, and the
+    bonds with a level (see Shells.bondlevels()) of at most k. As
+    each subgraph holds its own copies of the bonds, Protein.d() is
+    then the number of bonds on both sides plus the backbone edges
+    in only one of them.
+    """
+    assert isinstance(target, Protein)
+    assert isinstance(decoy, Protein)
+    windows = [range(i, i+3) for i in target.residueids[:-3]]
+    sources = sorted(set(r for w in windows for r in w))
+    tshells = target.shells(sources)
+    dshells = decoy.shells(sources)
+
+    tmask = target.resmask
+    ntarget = target.nresidues()
+    # number of backbone edges (i, i+1) on either side
+    m = max(len(tmask), len(decoy.resmask)) - 1
+    l = [[] for c in cutoffs]
+    for w in windows:
+        dt = tshells.distance(w)
+        dd = dshells.distance(w)
+        # every finite level is at most K; after K steps the
+        # subgraphs do not change
+        K = max(dt[dt < len(dt)].max(), dd[dd < len(dd)].max()) + 1
+
+        def counts(levels):
+            # counts[k]: number of levels <= k, for k = 0..K
+            return np.bincount(np.minimum(levels, K + 1),
+                               minlength=K + 2)[:K + 1].cumsum()
+
+        def edgelevels(d):
+            levels = np.full(m, K + 1, dtype=int)
+            levels[:len(d) - 1] = np.maximum(d[:-1], d[1:])
+            return levels
+
+        et, ed = edgelevels(dt), edgelevels(dd)
+        value = (counts(tshells.bondlevels(dt)) +
+                 counts(dshells.bondlevels(dd)) +
+                 counts(et) + counts(ed) - 2 * counts(np.maximum(et, ed)))
+        nres = counts(dd)
+        # the target subgraph equals target after k steps if
+        # kcover <= k < kout
+        kcover = dt[tmask].max()
+        kout = dt[~tmask].min() if (~tmask).any() else len(dt)
+        pending = []
+        for j, c in enumerate(cutoffs):
+            if value[0] > c:
+                l[j].append(nres[0])
+            else:
+                pending.append(j)
+        k = 0
+        while pending:
+            k += 1
+            if k > K:
+                # Nothing grows any more. Growing subgraphs would
+                # not stop here, so use the target subgraph size.
+                for j in pending:
+                    l[j].append(counts(dt)[K])
+                break
+            for j in pending:
+                if value[k] > cutoffs[j]:
+                    l[j].append(nres[k-1])
+            pending = [j for j in pending if not value[k] > cutoffs[j]]
+            if pending and kcover <= k < kout:
+                for j in pending:
+                    l[j].append(ntarget)
+                break
+    n = float(ntarget)
+    return [float(max(x))/n*100 for x in l]
+
+
+def computegdtg_grow(target, decoy, cutoffs):
+    """
+    computegdtg_multi() by growing subgraphs of target and decoy one
+    step at a time, keeping EditDistance up to date. Not used by the
+    other functions; kept as the reference implementation to check
+    computegdtg_multi() against.
+    """
     assert isinstance(target, Protein)
     assert isinstance(decoy, Protein)
-    l = []
+    l = [[] for c in cutoffs]
     for i in target.residueids[:-3]:
         tsub = target.subgraph(range(i, i+3))
         dsub = decoy.subgraph(range(i, i+3))
-        dist = Protein.d(tsub, dsub)
-        if dist > limit:
-            l.append(len(dsub.residueids))
-            continue
-        while True:
-            res = len(dsub.residueids)
-            tsub.grow(target)
-            dsub.grow(decoy)
-            if Protein.d(tsub, dsub) > limit:
-                l.append(res)
-                break
-            if tsub.residueids == target.residueids:
-                l.append(len(tsub.residueids))
+        dist = EditDistance(tsub, dsub)
+        # indices of cut-offs not yet exceeded in this window
+        pending = []
+        for k, c in enumerate(cutoffs):
+            if dist.value > c:
+                l[k].append(dsub.nresidues())
+            else:
+                pending.append(k)
+        while pending:
+            res = dsub.nresidues()
+            value = dist.update(tsub.grow(target), dsub.grow(decoy))
+            for k in pending:
+                if value > cutoffs[k]:
+                    l[k].append(res)
+            pending = [k for k in pending if not value > cutoffs[k]]
+            if pending and np.array_equal(tsub.resmask, target.resmask):
+                for k in pending:
+                    l[k].append(tsub.nresidues())
                 break
-    return float(max(l))/float(len(target.residueids))*100
+    n = float(target.nresidues())
+    return [float(max(x))/n*100 for x in l]
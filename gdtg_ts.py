@@ -9,7 +9,14 @@
 # seqfile is the file containing residue length for each target,
 # and tertiarydir is the directory with tertiary bond files.
 # It returns a dict of {decoy name: GDT-G}, unless the optional
-# output is specified.
+# output is specified. With workers > 1 decoys are scored in a pool
+# of worker processes; results are the same as in the serial run.
+# If target is a directory, all targets in it are scored in one run
+# (runbatch), streaming the results to a single output.
+# Parsed proteins are cached in cachedir, if given (see protcache.py).
+# Target and decoy directories may also be tar archives, such as
+# sample_data/candidates.tar.bz2, which are read without extraction
+# (see protarchive.py).
 #
 # Usage: Needs gdtcdp.py and cdp.py files in the same folder.
 #
@@ -19,78 +26,266 @@
 #
 
 import os
+import sys
 import argparse
+import multiprocessing
 import gdtcdp
+import protcache
+import protarchive
 
 
 # list of cut-off values to use when computing GDT-graph_TS
 cutoffs = [25, 50, 100, 200]
 
+# (target graph, decoy dir, tertiary dir, cache dir) in worker
+# processes
+_worker = None
 
-def run(targetf, seqfile, decoydir, tertiarydir, output=None):
+
+def run(targetf, seqfile, decoydir, tertiarydir, output=None,
+        workers=1, cachedir=None):
     ddir = os.path.abspath(decoydir)
     tertdir = os.path.abspath(tertiarydir)
 
-    # load target and decoy graphs in dicts
+    target = loadtarget(targetf, seqfile, tertdir, cachedir)
+    if protarchive.isarchive(ddir):
+        decoys = [m for m in protarchive.members(ddir)
+                  if m[0].startswith(target.name)]
+    else:
+        decoys = decoyfiles(ddir, target)
+    gdtgs = scoredecoys(target, decoys, ddir, tertdir, workers, cachedir)
+
+    if output:
+        with open(os.path.abspath(output), 'w') as outf:
+            writegdtgs(gdtgs, outf)
+        return
+
+    return gdtgs
+
+
+def runbatch(targetfs, seqfile, decoydir, tertiarydir, output=None,
+             workers=1, cachedir=None):
+    """
+    Computes GDT-graph_TS scores for the decoys of all given target
+    files (or all files in a given directory or archive). The decoy
+    directory is listed only once, and a decoy archive is read in a
+    single pass. Results are written target by target to output, or
+    to stdout.
+    """
+    ddir = os.path.abspath(decoydir)
+    tertdir = os.path.abspath(tertiarydir)
+    targets = loadtargets(targetfs, seqfile, tertdir, cachedir)
+    if protarchive.isarchive(ddir):
+        # Decoys arrive grouped by target, so all targets are
+        # loaded first
+        bytarget = dict((t.name, t) for t in targets)
+        groups = ((bytarget[k], list(g)) for k, g
+                  in protarchive.groupbytarget(protarchive.members(ddir))
+                  if k in bytarget)
+    else:
+        index = decoyindex(ddir)
+        groups = ((t, index.get(t.name, [])) for t in targets)
+
+    outf = open(os.path.abspath(output), 'w') if output else sys.stdout
+    try:
+        for target, decoys in groups:
+            gdtgs = scoredecoys(target, decoys,
+                                ddir, tertdir, workers, cachedir)
+            writegdtgs(gdtgs, outf)
+            outf.flush()
+    finally:
+        if output:
+            outf.close()
+
+
+def loadtargets(targetfs, seqfile, tertdir, cachedir=None):
+    """
+    Yields target graphs for a list of target files, or for all
+    files in a directory or archive.
+    """
+    if not isinstance(targetfs, str):
+        for targetf in targetfs:
+            yield loadtarget(targetf, seqfile, tertdir, cachedir)
+    elif protarchive.isarchive(targetfs):
+        # Temporary files are not worth caching
+        for _, targetf in protarchive.files(targetfs):
+            yield loadtarget(targetf, seqfile, tertdir)
+    else:
+        for _, targetf in protarchive.files(targetfs):
+            yield loadtarget(targetf, seqfile, tertdir, cachedir)
+
+
+def loadtarget(targetf, seqfile, tertdir, cachedir=None):
+    """
+    Returns graph (gdtcdp.Protein object) of the given target file,
+    with tertiary interactions and residue ids.
+    """
     targetfile = os.path.abspath(targetf)
     tname, _ = os.path.splitext(os.path.basename(targetfile))
-    tertfile = os.path.join(tertiarydir, os.path.basename(targetfile))
+    tertfile = os.path.join(tertdir, os.path.basename(targetfile))
     seqf = os.path.abspath(seqfile)
 
     target = gdtcdp.Protein(name=tname)
-    target.from_file(targetfile)
-    target.add_tertiary_interactions(tertfile)
+    protcache.from_file(target, targetfile, cachedir)
+    protcache.add_tertiary_interactions(target, tertfile, cachedir)
     target.addresidueids(seqf)
+    return target
 
-    decoys = makeprotdict(ddir, tertdir, target)
+
+def scoredecoys(target, files, ddir, tertdir, workers=1,
+                cachedir=None):
+    """
+    Returns a dict of {decoy name: GDT-graph_TS} for the given decoy
+    files of target. Decoys are file names in ddir, or tuples
+    (file name, contents) from an archive.
+    """
+    if workers > 1:
+        # Worker processes are forked with the target graph, so it
+        # is not pickled per task. Each task is one decoy file (or
+        # archive member).
+        pool = multiprocessing.Pool(workers, initializer=initworker,
+                                    initargs=(target, ddir, tertdir,
+                                              cachedir))
+        try:
+            return dict(pool.map(scorefile, sorted(files)))
+        finally:
+            pool.close()
+            pool.join()
 
     # compute gdtg_ts for each decoy and store in a dict
     gdtgs = {}
-    for dname, decoy in decoys.iteritems():
-        l = [gdtcdp.computegdtg(target, decoy, c) for c in cutoffs]
-        gdtg = float(sum(l))/float(len(l))
-        gdtgs[dname] = gdtg
+    for f in files:
+        decoy = loaddecoy(ddir, tertdir, f, target, cachedir)
+        gdtgs[decoy.name] = computegdtgts(target, decoy)
+    return gdtgs
 
-    if output:
-        with open(os.path.abspath(output), 'w') as outf:
-            for dname in gdtgs:
-                outf.write('{}\t{}\n'.format(dname, gdtgs[dname]))
-        return
 
-    return gdtgs
+def writegdtgs(gdtgs, outf):
+    """
+    Writes {decoy name: GDT-graph_TS} to file object outf, sorted by
+    decoy name.
+    """
+    for dname in sorted(gdtgs):
+        outf.write('{}\t{}\n'.format(dname, gdtgs[dname]))
+
+
+def computegdtgts(target, decoy):
+    """
+    Returns the GDT-graph_TS score, i.e. the mean GDT-G score over
+    cutoffs, of decoy w.r.t. target.
+    """
+    l = gdtcdp.computegdtg_multi(target, decoy, cutoffs)
+    return float(sum(l))/float(len(l))
+
+
+def initworker(target, protdir, tertdir, cachedir=None):
+    """
+    Pool initializer. Stores the shared arguments of scorefile() in
+    the worker process.
+    """
+    global _worker
+    _worker = (target, protdir, tertdir, cachedir)
+
+
+def scorefile(f):
+    """
+    Loads decoy file f and returns a tuple (decoy name, GDT-graph_TS)
+    using the target set by initworker().
+    """
+    target, protdir, tertdir, cachedir = _worker
+    prot = loaddecoy(protdir, tertdir, f, target, cachedir)
+    return prot.name, computegdtgts(target, prot)
+
 
+def decoyfiles(protdir, target):
+    """
+    Returns a list of decoy files in protdir corresponding to the
+    given target.
+    """
+    return [f for f in os.listdir(protdir)
+            if f.startswith(target.name)]
+
+
+def decoyindex(protdir):
+    """
+    Lists protdir once and returns a dict {target name: list of
+    decoy files}, where the target name is the part of the decoy
+    file name before the first '_'.
+    """
+    index = {}
+    for f in sorted(os.listdir(protdir)):
+        index.setdefault(f.split('_')[0], []).append(f)
+    return index
 
-def makeprotdict(protdir, tertdir, target):
+
+def loaddecoy(protdir, tertdir, f, target, cachedir=None,
+              tertcache=None):
+    """
+    Returns graph (gdtcdp.Protein object) of decoy file f, with the
+    residue ids of the given target. f may also be a tuple
+    (file name, contents) from protarchive.members(). tertcache is
+    the cache dir for the tertiary file, by default cachedir.
+    """
+    if isinstance(f, tuple):
+        name, data = f
+        # a temporary file is not worth caching, its tertiary file is
+        with protarchive.asfile(name, data) as path:
+            return loaddecoy(os.path.dirname(path), tertdir, name, target,
+                             None, cachedir)
+    if tertcache is None:
+        tertcache = cachedir
+    k, _ = os.path.splitext(f)
+    prot = gdtcdp.Protein(name=k)
+    protcache.from_file(prot, os.path.join(protdir, f), cachedir)
+    protcache.add_tertiary_interactions(prot, os.path.join(tertdir, f),
+                                        tertcache)
+    prot.residueids = target.residueids
+    return prot
+
+
+def makeprotdict(protdir, tertdir, target, cachedir=None):
     """
     Returns a dict containing {protein name: graph (gdtcdp.Protein
     object)}. The proteins are decoys corresponding to the given
     target.
     """
-    res = {}
-    gen = (f for f in os.listdir(protdir)
-           if f.startswith(target.name))
-    for f in gen:
-        k, _ = os.path.splitext(f)
-        prot = gdtcdp.Protein(name=k)
-        prot.from_file(os.path.join(protdir, f))
-        prot.add_tertiary_interactions(os.path.join(tertdir, f))
-        prot.residueids = target.residueids
-        res[k] = prot
-    return res
+    return dict((prot.name, prot) for prot
+                in iterdecoys(protdir, tertdir, target, cachedir))
+
+
+def iterdecoys(protdir, tertdir, target, cachedir=None):
+    """
+    Yields the graphs of the decoys in protdir corresponding to the
+    given target, loading them one at a time, in file name order.
+    """
+    for f in sorted(decoyfiles(protdir, target)):
+        yield loaddecoy(protdir, tertdir, f, target, cachedir)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('target', help='A target file.')
+    parser.add_argument('target', help='A target file, or a '
+                        'directory or archive of target files to '
+                        'score all targets in one run.')
     parser.add_argument('seqfile', help='A file containing '
                         'seqence length for all targets.')
-    parser.add_argument('decoy_dir', help='Directory containing '
-                        'decoy files.')
+    parser.add_argument('decoy_dir', help='Directory (or tar '
+                        'archive) containing decoy files.')
     parser.add_argument('tertiary_dir', help='Directory containing '
                         'tertiary interaction files.')
     parser.add_argument('--output', default=None,
                         help='Outpuf file. Default: None')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes. Default: 1')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory for cached parsed proteins. '
+                        'Default: None (no cache)')
     args = parser.parse_args()
-    run(args.target, args.seqfile,
-        args.decoy_dir, args.tertiary_dir,
-        args.output)
+    if os.path.isdir(args.target) or protarchive.isarchive(args.target):
+        runbatch(args.target, args.seqfile,
+                 args.decoy_dir, args.tertiary_dir,
+                 args.output, args.workers, args.cache_dir)
+    else:
+        run(args.target, args.seqfile,
+            args.decoy_dir, args.tertiary_dir,
+            args.output, args.workers, args.cache_dir)
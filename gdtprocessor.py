@@ -8,19 +8,46 @@
 # Methods:
 #  __init__: Load data from data_a#_n#.txt files to create
 #  np.ndarray object
+#  loadtable: Load one data_a#_n# table, as .npy or .txt file
+#  loadcube: Load all tables into one array, cached as .npy
 #  toidx: Converts parameter pair (a,n) to index along the 3rd axis
 #  toparam: Converts index along the 3rd axis to parameter pair (a,n)
 #  to2d: Converts input vector to column vector with ndim=2
 #  extract: Extract data from array for least sq analysis
+#  mastercols: Columns of the master matrix used by (avals, nvals)
+#  gram: Gram matrix of the master matrix of all parameters
+#  gramlstsq: Least square solution from the Gram matrix
+#  colname: Name of a master matrix column
+#  hits: Targets whose guess is within given %-pt of max GDT
+#  stepwise: Forward/backward selection of master matrix columns
 #  runlstsq: Runs least square analysis
+#  targetlabels: Target index of each row
+#  targetgrams: Gram matrices of Z for the rows of each target
+#  runcv: Leave-one-target-out cross-validation of runlstsq
+#  bootstrap: Bootstrap intervals of the solution, resampling targets
+#  groups: Row ranges of the targets, for evaluate
 #  evaluate: Evaluate the results from least square analysis
+#  evaluatelist: evaluate, one target at a time in Python
 #
 # Author: Yuki Koyanagi
 # History:
 #  2016-10-14 (yk): Created
 #  2016-11-08 (yk): Added noarr option to init
+#  2026-10-18: Load data_a#_n#.npy tables written by
+#  compare_decoys_to_target.py where present
+#  2026-10-18: Fill a preallocated array instead of repeated
+#  np.dstack, and cache it as a memory-mapped .npy file
+#  2026-10-18: Added Gram matrix engine for runlstsq
+#  2026-10-18: Added stepwise column selection
+#  2026-10-18: Vectorised evaluate
+#  2026-10-18: Added leave-one-target-out cross-validation
+#  2026-10-18: Added bootstrap intervals
 
 
+import os
+import glob
+import hashlib
+import tempfile
 import numpy as np
 from itertools import groupby
 from operator import itemgetter
@@ -28,32 +55,179 @@ from operator import itemgetter
 # Columns to use in data_a#_n#.txt files
 cols = (2, 3, 4, 5, 6)
 namecols = (0, 1)
+# Prefix of cached data arrays, see loadcube()
+cubeprefix = 'gdtcube_'
 # Column in prediction array containing GDT score
 gdtcol = 1
 # Column in prediction array containing GDT guess
 guesscol = -3  # 3rd last
+# Smallest ratio of the least to the largest singular value of the
+# column-scaled Z for which a system is solved from its Gram matrix.
+# The normal equations square the condition number, so below this
+# they lose too many digits to match np.linalg.lstsq.
+gramcond = np.sqrt(np.finfo(float).eps) * 1e4
+
+
+def cholinsert(L, g, gjj):
+    """
+    Given the lower Cholesky factor L of a matrix G, returns the
+    factor of G with the column g (and diagonal entry gjj) appended,
+    or None if the new column is numerically dependent on the others.
+    """
+    p = L.shape[0]
+    l = trisolve(L, g)
+    d2 = gjj - np.dot(l, l)
+    if d2 <= gjj * 1e-10:
+        return None
+    Ln = np.zeros((p + 1, p + 1))
+    Ln[:p, :p] = L
+    Ln[p, :p] = l
+    Ln[p, p] = np.sqrt(d2)
+    return Ln
+
+
+def trisolve(L, b, trans=False):
+    """
+    Solves L x = b, or L^T x = b with trans, for lower triangular L
+    by forward (back) substitution in O(p^2).
+    """
+    p = len(b)
+    x = np.empty(p)
+    if trans:
+        for i in range(p - 1, -1, -1):
+            x[i] = (b[i] - np.dot(L[i+1:, i], x[i+1:])) / L[i, i]
+    else:
+        for i in range(p):
+            x[i] = (b[i] - np.dot(L[i, :i], x[:i])) / L[i, i]
+    return x
+
+
+def illconditioned(G):
+    """
+    Given a stack of Gram matrices G[k] = Z_k^T Z_k, returns a boolean
+    array which is True where Z_k is singular or has a ratio of least
+    to largest singular value below gramcond.
+    """
+    e = np.linalg.eigvalsh(G)
+    top = e[:, -1]
+    ratio = np.sqrt(np.clip(e[:, 0], 0, None) / np.where(top > 0, top, 1))
+    return ~(ratio >= gramcond)
+
+
+def choldelete(L, k):
+    """
+    Given the lower Cholesky factor L of a matrix G, returns the
+    factor of G with row and column k removed, by a rank-one update
+    of the trailing block.
+    """
+    Ln = np.delete(np.delete(L, k, axis=0), k, axis=1)
+    x = L[k+1:, k].copy()
+    T = Ln[k:, k:]  # view
+    for i in range(len(x)):
+        r = np.hypot(T[i, i], x[i])
+        c = r / T[i, i]
+        s = x[i] / T[i, i]
+        T[i, i] = r
+        T[i+1:, i] = (T[i+1:, i] + s * x[i+1:]) / c
+        x[i+1:] = c * x[i+1:] - s * T[i+1:, i]
+    return Ln
 
 
 class Gdtprocessor:
 
     def __init__(self, dir=None,
                  arange=range(4, 13), nrange=range(1, 11),
-                 noarr=False):
+                 noarr=False, cache=True):
         if dir is None:
             dir = '.'
         self._arange = arange
         self._nrange = nrange
         if noarr:
             return  # Creation without array
-        for idx in [(a, n) for a in arange for n in nrange]:
-            fn = '{}/data_a{}_n{}.txt'.format(dir, idx[0], idx[1])
+        fns = ['{}/data_a{}_n{}'.format(dir, a, n)
+               for a in arange for n in nrange]
+        self._arr, self._prot = self.loadcube(dir, fns, cache)
+
+    def loadcube(self, dir, fns, cache=True):
+        """
+        Loads the tables fns (without extension) and stacks them along
+        the 3rd axis. Returns a tuple (data array, name columns).
+        With cache, the result is saved in dir as a .npy file named
+        after the tables and their mtimes and sizes, and later calls
+        memory-map it (read only) instead of loading the tables again.
+        A cache file is replaced when any of the tables change. Only
+        caches of the same tables are replaced, so each set of
+        (arange, nrange) keeps its own gdtcube_* pair in dir until it
+        is deleted by hand.
+        """
+        srcs = [fn + '.npy' if os.path.exists(fn + '.npy') else fn + '.txt'
+                for fn in fns]
+        if cache:
+            stamp = [(os.path.basename(f), os.stat(f).st_mtime,
+                      os.stat(f).st_size) for f in srcs]
+            group = hashlib.sha1(repr(srcs).encode()).hexdigest()[:16]
+            key = hashlib.sha1(repr(stamp).encode()).hexdigest()[:16]
+            base = os.path.join(dir, '{}{}_{}'.format(cubeprefix,
+                                                       group, key))
             try:
-                self._arr = np.dstack((self._arr,
-                                      np.loadtxt(fn, usecols=cols)))
-            except AttributeError:
-                self._arr = np.loadtxt(fn, usecols=cols)
-                self._prot = np.loadtxt(fn, dtype='a8, a15',
-                                        usecols=namecols)
+                return (np.load(base + '.npy', mmap_mode='r'),
+                        np.load(base + '_prot.npy'))
+            except (IOError, ValueError):
+                pass  # missing or unreadable; load the tables
+
+        data, prot = self.loadtable(fns[0])
+        if cache:
+            fd, tmpf = tempfile.mkstemp(dir=dir, suffix='.npy')
+            os.close(fd)
+            arr = np.lib.format.open_memmap(
+                tmpf, mode='w+', dtype=data.dtype,
+                shape=data.shape + (len(fns),))
+        else:
+            arr = np.empty(data.shape + (len(fns),), dtype=data.dtype)
+        try:
+            arr[:, :, 0] = data
+            for i, fn in enumerate(fns[1:], 1):
+                arr[:, :, i] = self.loadtable(fn)[0]
+        except BaseException:
+            if cache:
+                # do not leave a partial cache file behind
+                del arr
+                os.remove(tmpf)
+            raise
+        if not cache:
+            return arr, prot
+
+        arr.flush()
+        del arr
+        for f in glob.glob(os.path.join(dir, cubeprefix + group + '_*')):
+            os.remove(f)
+        np.save(base + '_prot.npy', prot)
+        # The data array is written last, so a complete pair exists
+        # once it is in place
+        os.rename(tmpf, base + '.npy')
+        return np.load(base + '.npy', mmap_mode='r'), prot
+
+    def loadtable(self, fn):
+        """
+        Loads the table fn (without extension) and returns a tuple
+        (data columns, name columns). fn.npy, a structured array
+        written by compare_decoys_to_target.py, is used if it exists,
+        and fn.txt otherwise. Columns are picked by position, so
+        both give the same layout (the .npy values are not rounded
+        as in the text output).
+        """
+        if os.path.exists(fn + '.npy'):
+            table = np.load(fn + '.npy')
+            names = table.dtype.names
+            data = np.column_stack([table[names[c]].astype(float)
+                                    for c in cols])
+            prot = np.empty(len(table), dtype='a8, a15')
+            for f, c in zip(prot.dtype.names, namecols):
+                prot[f] = table[names[c]]
+            return data, prot
+        fn = fn + '.txt'
+        return (np.loadtxt(fn, usecols=cols),
+                np.loadtxt(fn, dtype='a8, a15', usecols=namecols))
 
     def paramtoidx(self, a, n):
         """
@@ -107,7 +281,164 @@ class Gdtprocessor:
         Y = self._arr[:, 0, 0]
         return Y, Z
 
-    def runlstsq(self, avals, nvals):
+    def mastercols(self, avals, nvals):
+        """
+        The matrix Z of extract(avals, nvals) is a column subset of
+        the master matrix
+        [1, B, C(all a,n), D(all a,n), E(all a,n)],
+        where each block of C, D, E has one column per index along
+        the 3rd axis. Returns the list of master columns of Z.
+        """
+        K = self._arr.shape[2]
+        return ([0, 1] +
+                [2 + self.paramtoidx(avals[0], n) for n in nvals] +
+                [2 + K + self.paramtoidx(a, nvals[0]) for a in avals] +
+                [2 + 2*K + self.paramtoidx(a, n)
+                 for a in avals
+                 for n in nvals])
+
+    def gram(self):
+        """
+        Returns (M^T M, M^T Y) for the master matrix M (see
+        mastercols). They are computed on first use only, and M is
+        kept in self._master.
+        """
+        try:
+            return self._gram
+        except AttributeError:
+            pass
+        nrows = self._arr.shape[0]
+        M = np.hstack((np.ones((nrows, 1)), self._arr[:, 1, [0]],
+                       self._arr[:, 2, :], self._arr[:, 3, :],
+                       self._arr[:, 4, :]))
+        Y = self._arr[:, 0, 0]
+        self._master = M
+        self._gram = (np.dot(M.T, M), np.dot(M.T, Y))
+        return self._gram
+
+    def gramlstsq(self, avals, nvals):
+        """
+        Solves the least square problem of (avals, nvals) by Cholesky
+        decomposition of the submatrix of the Gram matrix. Returns
+        (solution, rank, singular values of Z) as np.linalg.lstsq, or
+        None if Z is rank deficient or too badly conditioned (see
+        gramcond) to be solved from the Gram matrix.
+        """
+        G, b = self.gram()
+        c = self.mastercols(avals, nvals)
+        Gs = G[np.ix_(c, c)]
+        bs = b[c]
+        # Singular values of Z are the square roots of the eigenvalues
+        # of Z^T Z. Rank uses the tolerance of np.linalg.lstsq.
+        sing = np.sqrt(np.clip(np.linalg.eigvalsh(Gs), 0, None))[::-1]
+        rank = int((sing > sing[0] * max(self._arr.shape[0], len(c)) *
+                    np.finfo(float).eps).sum())
+        if rank < len(c):
+            return None
+        # Scale to unit diagonal for better conditioning
+        d = 1 / np.sqrt(np.diag(Gs))
+        Gd = Gs * np.outer(d, d)
+        if illconditioned(Gd[None])[0]:
+            return None
+        try:
+            L = np.linalg.cholesky(Gd)
+        except np.linalg.LinAlgError:
+            return None
+        A = d * np.linalg.solve(L.T, np.linalg.solve(L, d * bs))
+        return A, rank, sing
+
+    def colname(self, c):
+        """
+        Returns the name of master column c (see mastercols), e.g.
+        'C(a4,n6)'.
+        """
+        if c < 2:
+            return ('1', 'B')[c]
+        blk, i = divmod(c - 2, self._arr.shape[2])
+        return '{}(a{},n{})'.format('CDE'[blk],
+                                    self._arange[i // len(self._nrange)],
+                                    self._nrange[i % len(self._nrange)])
+
+    def hits(self, Y, pred, pts=(2, 10)):
+        """
+        Returns, for each pt in pts, the number of targets whose
+        'guess' decoy by the predicted values pred is less than pt
+        from the max. GDT, as in evaluate().
+        """
+        resid = Y - pred
+        ev = self.evaluate(np.column_stack((Y, pred, resid, resid**2)))
+        return tuple(len([r for r in ev if r[-1] < pt]) for pt in pts)
+
+    def stepwise(self, cols=None, start=(0, 1), maxcols=None,
+                 pts=(2, 10)):
+        """
+        Greedy forward/backward selection of master columns (see
+        mastercols). Starting from the columns start, which are
+        always kept, each forward step adds the column in cols
+        (default all) with the most hits (see hits(), compared for
+        pts in order, ties broken by the smaller sum of squared
+        residuals). It is accepted only if the hits improve. After
+        each addition, columns are removed one at a time as long as
+        that improves the hits. Stops when no column improves the
+        hits, or when there are maxcols columns.
+        Candidates are solved from the Gram matrix by triangular
+        solves with its Cholesky factor, which is updated (rank-one)
+        when adding and removing columns, in O(p^2) per candidate.
+        Returns (selected columns, hits, history), where history is a
+        list of ('+' or '-', column, hits) for each step.
+        """
+        G, b = self.gram()
+        M = self._master
+        Y = self._arr[:, 0, 0]
+        if cols is None:
+            cols = range(M.shape[1])
+
+        def score(S, L):
+            x = trisolve(L, trisolve(L, b[S]), trans=True)
+            # b.x = Y.Y - sum of squared residuals
+            return self.hits(Y, np.dot(M[:, S], x), pts) + (np.dot(b[S], x),)
+
+        S = []
+        L = np.empty((0, 0))
+        for c in start:
+            L = cholinsert(L, G[S, c], G[c, c])
+            if L is None:
+                raise ValueError('Start columns are linearly dependent')
+            S.append(c)
+        cur = score(S, L)
+        cand = [c for c in cols if c not in S]
+        history = []
+        while maxcols is None or len(S) < maxcols:
+            best = None
+            for c in cand:
+                Ln = cholinsert(L, G[S, c], G[c, c])
+                if Ln is None:
+                    continue
+                sc = score(S + [c], Ln)
+                if best is None or sc > best[0]:
+                    best = (sc, c, Ln)
+            if best is None or best[0][:-1] <= cur[:-1]:
+                break
+            cur, c, L = best
+            S.append(c)
+            cand.remove(c)
+            history.append(('+', c, cur[:-1]))
+            while True:
+                best = None
+                for k in range(len(start), len(S)):
+                    Ln = choldelete(L, k)
+                    sc = score(S[:k] + S[k+1:], Ln)
+                    if best is None or sc > best[0]:
+                        best = (sc, k, Ln)
+                if best is None or best[0][:-1] <= cur[:-1]:
+                    break
+                cur, k, L = best
+                c = S.pop(k)
+                cand.append(c)
+                history.append(('-', c, cur[:-1]))
+        return S, cur[:-1], history
+
+    def runlstsq(self, avals, nvals, engine='lstsq'):
         """
         Performs least square computation using dependent variables
         given in parameter combination (avals, nvals).
@@ -121,24 +452,180 @@ class Gdtprocessor:
         -3 (3rd last): predicted GDT value
         -2 (2nd last): GDT - predicted
         -1 (last): (GDT - predicted)^2
+        With engine='gram' the solution is computed by gramlstsq(),
+        falling back to np.linalg.lstsq if Z is rank deficient.
         """
         self._avals = avals
         self._nvals = nvals
-        Y, Z = self.extract(self._avals, self._nvals)
-        try:
-            A, res, rank, sing = np.linalg.lstsq(Z, Y)
-        except np.LinAlgError:
-            print('Least square computation does not converge.\n')
-            print('a values:{}, n values:{}\n'.format(avals, nvals))
-            return
-        result = (A, res, rank, sing)
+        sol = None
+        if engine == 'gram':
+            sol = self.gramlstsq(avals, nvals)
+            # Same columns as extract(), but sliced from the master
+            # matrix instead of the data array
+            Y = self._arr[:, 0, 0]
+            Z = self._master[:, self.mastercols(avals, nvals)]
+        else:
+            Y, Z = self.extract(self._avals, self._nvals)
+        if sol is None:
+            try:
+                A, res, rank, sing = np.linalg.lstsq(Z, Y)
+            except np.linalg.LinAlgError:
+                print('Least square computation does not converge.\n')
+                print('a values:{}, n values:{}\n'.format(avals, nvals))
+                return
+        else:
+            A, rank, sing = sol
         pred = np.dot(Z, A)
         resid = Y - pred
         resid2 = resid**2
-        p = (self.to2d(A) for A in (Y, Z, pred, resid, resid2))
+        if sol is not None:
+            # As np.linalg.lstsq: empty unless Z has full column rank
+            # and more rows than columns
+            res = (np.array([resid2.sum()]) if Z.shape[0] > Z.shape[1]
+                   else np.empty(0))
+        result = (A, res, rank, sing)
+        p = [self.to2d(A) for A in (Y, Z, pred, resid, resid2)]
         prediction = np.hstack(p)
         return result, prediction
 
+    def groups(self):
+        """
+        Returns (starts, runs) for the rows of self._prot. starts are
+        the first rows of each run of rows with the same target name
+        (plus the number of rows at the end), and runs are the
+        indices of the runs to evaluate, one per target in order of
+        first appearance. If a target has several runs, the last is
+        used, as in evaluate(). Computed on first use only.
+        """
+        try:
+            return self._groups
+        except AttributeError:
+            pass
+        names = self._prot['f0']
+        starts = np.flatnonzero(np.concatenate(
+            ([True], names[1:] != names[:-1])))
+        first = {}
+        last = {}
+        for i, name in enumerate(names[starts].tolist()):
+            first.setdefault(name, i)
+            last[name] = i
+        runs = np.array([last[name]
+                         for name in sorted(first, key=first.get)], dtype=int)
+        self._groups = (np.append(starts, len(names)), runs)
+        return self._groups
+
+    def targetlabels(self):
+        """
+        Returns (number of targets, target index of each row).
+        Computed on first use only.
+        """
+        try:
+            return self._labels
+        except AttributeError:
+            pass
+        names, labels = np.unique(self._prot['f0'], return_inverse=True)
+        self._labels = (len(names), labels)
+        return self._labels
+
+    def targetgrams(self, avals, nvals, engine='lstsq'):
+        """
+        Returns (Y, Z, Gt, bt, d) for (avals, nvals), where Gt[t] and
+        bt[t] are Z^T Z and Z^T Y over the rows of target t (see
+        targetlabels), and d scales the columns of Z to unit norm.
+        """
+        if engine == 'gram':
+            self.gram()
+            Y = self._arr[:, 0, 0]
+            Z = self._master[:, self.mastercols(avals, nvals)]
+        else:
+            Y, Z = self.extract(avals, nvals)
+        T, labels = self.targetlabels()
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(T + 1))
+        Zs = Z[order]
+        Ys = Y[order]
+        Gt = np.array([np.dot(Zs[i:j].T, Zs[i:j])
+                       for i, j in zip(bounds[:-1], bounds[1:])])
+        bt = np.array([np.dot(Zs[i:j].T, Ys[i:j])
+                       for i, j in zip(bounds[:-1], bounds[1:])])
+        diag = np.diag(Gt.sum(axis=0))
+        d = 1 / np.sqrt(np.where(diag > 0, diag, 1))
+        return Y, Z, Gt, bt, d
+
+    def solvemany(self, G, b, fit):
+        """
+        Solves the stack of (column-scaled) Gram systems G[k] x = b[k]
+        in one batch. Systems which are singular or too badly
+        conditioned for that (see gramcond) are instead solved by
+        fit(k), from the rows of Z.
+        """
+        bad = illconditioned(G)
+        X = np.empty(b.shape)
+        ok = ~bad
+        if ok.any():
+            X[ok] = np.linalg.solve(G[ok], b[ok][..., None])[..., 0]
+        for k in np.flatnonzero(bad):
+            X[k] = fit(k)
+        return X
+
+    def bootstrap(self, avals, nvals, nboot=1000, level=95, seed=None,
+                  engine='lstsq'):
+        """
+        Bootstrap of the solution of runlstsq(avals, nvals), resampling
+        whole targets with replacement. A replicate's Gram matrix is
+        the sum of the per-target Gram matrices (see targetgrams)
+        weighted by how often each target is drawn, so all nboot
+        replicates are solved in one batch without touching Z again.
+        Returns (lower, upper, replicates), where lower and upper are
+        the percentile bounds of the central level% interval of each
+        coefficient, and replicates has one row per replicate.
+        """
+        Y, Z, Gt, bt, d = self.targetgrams(avals, nvals, engine)
+        T, labels = self.targetlabels()
+        rng = np.random.RandomState(seed)
+        W = rng.multinomial(T, [1.0 / T] * T, size=nboot).astype(float)
+        G = np.einsum('kt,tij->kij', W, Gt) * np.outer(d, d)
+        b = np.dot(W, bt) * d
+
+        def fit(k):
+            # rows weighted by how often their target is drawn
+            w = np.sqrt(W[k][labels])
+            return np.linalg.lstsq(Z * d * w[:, None], Y * w,
+                                   rcond=None)[0]
+
+        X = self.solvemany(G, b, fit) * d
+        tail = (100 - level) / 2.0
+        lower, upper = np.percentile(X, [tail, 100 - tail], axis=0)
+        return lower, upper, X
+
+    def runcv(self, avals, nvals, engine='lstsq'):
+        """
+        Leave-one-target-out cross-validation of runlstsq(avals,
+        nvals, engine). The decoys of each target are predicted by the
+        solution fitted to all other targets. That solution is found
+        from the Gram matrix of Z by subtracting the target's own
+        Gram matrix, with the (column-scaled) systems of all targets
+        solved in one batch, so Z is only passed over once.
+        Returns (sum of squared CV residuals, prediction), with
+        prediction in the format of runlstsq, so that it can be
+        passed to evaluate().
+        """
+        Y, Z, Gt, bt, d = self.targetgrams(avals, nvals, engine)
+        T, labels = self.targetlabels()
+        G = Gt.sum(axis=0)
+
+        def fit(t):
+            rows = labels != t
+            return np.linalg.lstsq(Z[rows] * d, Y[rows], rcond=None)[0]
+
+        X = self.solvemany((G - Gt) * np.outer(d, d),
+                           (bt.sum(axis=0) - bt) * d, fit) * d
+        pred = np.einsum('ij,ij->i', Z, X[labels])
+        resid = Y - pred
+        resid2 = resid**2
+        p = [self.to2d(A) for A in (Y, Z, pred, resid, resid2)]
+        return resid2.sum(), np.hstack(p)
+
     def evaluate(self, prediction):
         """
         Evaluate prediction results. Returns a list of tuples, one
@@ -146,6 +633,38 @@ class Gdtprocessor:
         (target, 'winner' decoy, gdt of 'winner' decoy,
         'guess' decoy, gdt of 'guess' decoy,
         winner gdt - guess gdt)
+        The winner and guess are the first decoys of each target with
+        the max. GDT and the max. prediction, found by grouped
+        reductions over the rows of each target (see groups()).
+        """
+        gdt = prediction[:, gdtcol - 1]
+        guess = prediction[:, guesscol]
+        if np.isnan(gdt).any() or np.isnan(guess).any():
+            # max() does not order NaN as np.maximum does
+            return self.evaluatelist(prediction)
+        bounds, runs = self.groups()
+        starts = bounds[:-1]
+        rows = np.arange(len(gdt))
+        lengths = np.diff(bounds)
+
+        def firstmax(v):
+            # first row in each run with the run's max. value
+            m = np.repeat(np.maximum.reduceat(v, starts), lengths)
+            return np.minimum.reduceat(np.where(v == m, rows, len(v)),
+                                       starts)[runs]
+
+        w = firstmax(gdt)
+        g = firstmax(guess)
+        tnames = self._prot['f0'][starts[runs]].tolist()
+        dnames = self._prot['f1']
+        return list(zip(tnames,
+                        dnames[w].tolist(), gdt[w].tolist(),
+                        dnames[g].tolist(), gdt[g].tolist(),
+                        (gdt[w] - gdt[g]).tolist()))
+
+    def evaluatelist(self, prediction):
+        """
+        evaluate() on Python lists, one target at a time.
         """
         d = {}
         allpred = [name + tuple(pred)
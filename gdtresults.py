@@ -5,16 +5,184 @@
 # Time-stamp: <2016-10-18 15:44:03 au447708>
 #
 # Description: Methods for processing text files produced by analysegdt
-#  script.
+#  script, and the structured results store it writes alongside.
 # Methods:
 #  loaddata: Load data from specified txt file.
+#  Resultwriter: Writes the results store, one combination at a time
+#  loadsummary: Load the per-combination summary of a results store
+#  torecords: Summary rows as Record namedtuples, as loaddata
+#  topk: Top-k combinations by a summary metric
+#  coefficients: Least square solution of one combination
+#  deviations: Per-target deviations of one combination
 #
 # Author: Yuki Koyanagi
 # History:
+#  2026-10-18: Added structured results store
 #
 
 
+import os
 from collections import namedtuple
+import numpy as np
+
+Record = namedtuple('Record', 'avals, nvals, pct2_all, '
+                    'pct10_all, pct2_40, pct10_40')
+
+# Files of a results store in the data dir. The summary has one row
+# per parameter combination; coefficients of combination i are
+# coefs[coefstart:coefstart+ncoef], and its per-target deviations
+# are row i of deviations, with columns in the order of targets.
+storefiles = {'summary': 'results_summary.npy',
+              'coefs': 'results_coefs.npy',
+              'deviations': 'results_deviations.npy',
+              'targets': 'results_targets.npy'}
+
+devdtype = np.dtype([('winner', 'S15'), ('wgdt', float),
+                     ('guess', 'S15'), ('ggdt', float),
+                     ('dev', float)])
+
+# Metrics in the summary for which smaller is better
+ascending = ('ssr', 'cvssr')
+
+
+class Resultwriter:
+    """
+    Writes analysegdt results for a list of parameter combinations to
+    a results store in dir (see storefiles). All arrays are allocated
+    as .npy memmaps up front and filled in with add(), so memory use
+    does not grow with the number of combinations.
+    """
+
+    def __init__(self, dir, params):
+        width = max(len(','.join(map(str, v)))
+                    for p in params for v in p)
+        self._dtype = np.dtype([('avals', 'S{}'.format(width)),
+                                ('nvals', 'S{}'.format(width)),
+                                ('ssr', float), ('rank', int),
+                                ('coefstart', int), ('ncoef', int),
+                                ('n2_all', int), ('n10_all', int),
+                                ('n2_40', int), ('n10_40', int),
+                                ('pct2_all', float), ('pct10_all', float),
+                                ('pct2_40', float), ('pct10_40', float),
+                                ('cvssr', float),
+                                ('cvpct2_all', float),
+                                ('cvpct10_all', float)])
+        ncoefs = [2 + len(nv) + len(av) + len(av) * len(nv)
+                  for av, nv in params]
+        self._coefstart = np.cumsum([0] + ncoefs)
+        self._paths = dict((k, os.path.join(dir, f))
+                           for k, f in storefiles.items())
+        openmm = np.lib.format.open_memmap
+        self._summary = openmm(self._paths['summary'], mode='w+',
+                               dtype=self._dtype, shape=(len(params),))
+        self._coefs = openmm(self._paths['coefs'], mode='w+',
+                             dtype=float, shape=(sum(ncoefs),))
+        self._devs = None  # allocated when the targets are known
+        self._i = 0
+
+    def add(self, r):
+        """
+        Adds the results r = (avals, nvals, (solution, sum of sqr
+        of residuals, rank, singular values), evaluation[, cv]) of
+        the next combination. evaluation is as Gdtprocessor.evaluate,
+        sorted by target, and cv, if not None, is (sum of sqr of
+        cross-validation residuals, evaluation of CV prediction).
+        The cv fields of the summary are NaN without cv.
+        """
+        i = self._i
+        avals, nvals, result, evaluation = r[:4]
+        cv = r[4] if len(r) > 4 else None
+        A, res, rank = result[:3]
+        start = self._coefstart[i]
+        self._coefs[start:start + len(A)] = A
+        devs = np.array([row[1:] for row in evaluation], dtype=devdtype)
+        if self._devs is None:
+            targets = np.array([row[0] for row in evaluation], dtype='S8')
+            np.save(self._paths['targets'], targets)
+            self._devs = np.lib.format.open_memmap(
+                self._paths['deviations'], mode='w+', dtype=devdtype,
+                shape=(len(self._summary), len(targets)))
+        self._devs[i] = devs
+        dev, over40 = devs['dev'], devs['wgdt'] > 40
+        counts = [(dev < 2).sum(), (dev < 10).sum(),
+                  (dev[over40] < 2).sum(), (dev[over40] < 10).sum()]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pcts = [c / float(n) * 100 for c, n
+                    in zip(counts, [len(dev)] * 2 + [over40.sum()] * 2)]
+        cvs = (np.nan,) * 3
+        if cv is not None:
+            cvdev = np.array([row[-1] for row in cv[1]])
+            cvs = (cv[0], (cvdev < 2).mean() * 100,
+                   (cvdev < 10).mean() * 100)
+        self._summary[i] = ((','.join(map(str, avals)),
+                             ','.join(map(str, nvals)),
+                             res[0] if len(res) else np.nan, rank,
+                             start, len(A)) + tuple(counts) + tuple(pcts) +
+                            cvs)
+        self._i += 1
+
+    def close(self):
+        for arr in (self._summary, self._coefs, self._devs):
+            if arr is not None:
+                arr.flush()
+        del self._summary, self._coefs, self._devs
+
+
+def loadsummary(dir):
+    """
+    Returns the summary of the results store in dir, as a read-only
+    memmap of a structured array with one row per combination.
+    """
+    return np.load(os.path.join(dir, storefiles['summary']),
+                   mmap_mode='r')
+
+
+def torecords(summary):
+    """
+    Returns the summary rows as a list of Record namedtuples, as
+    loaddata() returns for result.txt.
+    """
+    return [Record([int(v) for v in row['avals'].split(b',')],
+                   [int(v) for v in row['nvals'].split(b',')],
+                   float(row['pct2_all']), float(row['pct10_all']),
+                   float(row['pct2_40']), float(row['pct10_40']))
+            for row in summary]
+
+
+def topk(summary, metric, k=10):
+    """
+    Returns the indices of the k best combinations in summary by
+    metric (a summary field, e.g. 'pct2_all' or 'ssr'), best first.
+    Larger is better, except for the metrics in ascending.
+    """
+    v = np.asarray(summary[metric], dtype=float)
+    if metric not in ascending:
+        v = -v
+    return np.argsort(v, kind='stable')[:k]
+
+
+def coefficients(dir, i, summary=None):
+    """
+    Returns the least square solution of combination i of the
+    results store in dir.
+    """
+    if summary is None:
+        summary = loadsummary(dir)
+    start, n = summary[i]['coefstart'], summary[i]['ncoef']
+    coefs = np.load(os.path.join(dir, storefiles['coefs']), mmap_mode='r')
+    return np.array(coefs[start:start + n])
+
+
+def deviations(dir, i):
+    """
+    Returns (targets, deviations) for combination i of the results
+    store in dir; deviations is a structured array of devdtype with
+    one row per target.
+    """
+    targets = np.load(os.path.join(dir, storefiles['targets']))
+    devs = np.load(os.path.join(dir, storefiles['deviations']),
+                   mmap_mode='r')
+    return targets, np.array(devs[i])
 
 
 def tofile(lst, f):
@@ -36,8 +204,6 @@ def loaddata(f):
     Returns a list of namedtuples: (avals, nvals, 2%_all, 10%_all,
     2%_>40, 10%_>40)
     """
-    Record = namedtuple('Record', 'avals, nvals, pct2_all, '
-                        'pct10_all, pct2_40, pct10_40')
     with open(f) as initf:
         for line in initf:
             if line.startswith('Results for parameter'):
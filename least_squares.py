@@ -29,10 +29,18 @@
 # TODO: Add option to print the input values, but with a few columns
 # appended: Certainly the value which one would get by using the found
 # a_j values, but maybe also the quadratic deviation.
+#
+# With --stream, the input is parsed --chunk-size rows at a time and A
+# is found from a QR factorisation of [Z Y] which is updated with each
+# chunk, so memory use does not depend on m. With --outfile, the
+# parsed rows are spooled to a temporary binary file and the output
+# file is written from it in chunks.
 
 import sys
 import argparse
 import fileinput
+import itertools
+import tempfile
 import numpy as np
 
 from argparse import ArgumentParser
@@ -40,12 +48,91 @@ parser = ArgumentParser()
 
 parser.add_argument("--outfile")
 
+parser.add_argument("--stream", action="store_true",
+                    help="fit in chunks, in memory independent of the number of rows")
+
+parser.add_argument("--chunk-size", type=int, default=100000,
+                    help="rows per chunk with --stream, default 100000")
+
+
+def read_chunks(files, size):
+    # Yields arrays of up to size input rows
+    lines = fileinput.input(files)
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield np.array([l.split() for l in chunk], dtype=float)
+
+
+def stream_fit(chunks, spool=None):
+    # Returns (A, res, rank, sing, m) as np.linalg.lstsq (with res the
+    # sum of squared residuals) and the number of rows m, for all rows
+    # in chunks. The R factor of [Z Y] is updated by factorising
+    # [R; next chunk]. Parsed rows are also written to spool, if given.
+    R = None
+    m = 0
+    for C in chunks:
+        if spool is not None:
+            C.tofile(spool)
+        m += len(C)
+        ZY = np.hstack((np.ones((len(C), 1)), C[:, 1:], C[:, :1]))
+        if R is not None:
+            ZY = np.vstack((R, ZY))
+        R = np.linalg.qr(ZY, mode='r')
+    p = R.shape[1] - 1
+    if R.shape[0] <= p:
+        R = np.vstack((R, np.zeros((p + 1 - R.shape[0], p + 1))))
+    # Z^T Z = R^T R and Z^T Y = R^T (Q^T Y), so this has the same
+    # solutions as the full problem. Rounding in the updates is of
+    # order eps*m, so singular values below eps*max(m, p)*s_max are
+    # taken as zero, as they would be for Z itself.
+    rcond = np.finfo(float).eps * max(m, p)
+    A, _, rank, sing = np.linalg.lstsq(R[:p, :p], R[:p, p], rcond=rcond)
+    # R[p, p]**2 is the residual only at full rank
+    res = np.sum((R[:p+1, p] - np.dot(R[:p+1, :p], A))**2)
+    return A, res, rank, sing, m
+
+
+def write_stream(outfile, spool, A, size):
+    # Writes the output file from the rows in spool, a chunk at a time
+    k = len(A)
+    spool.seek(0)
+    with open(outfile, "w") as f:
+        while True:
+            C = np.fromfile(spool, count=size*k).reshape(-1, k)
+            if not len(C):
+                break
+            Z = C.copy()
+            Z[:, 0] = 1.0
+            pred = np.dot(Z, A)
+            resid = C[:, 0] - pred
+            np.savetxt(f, np.column_stack((C[:, 0], Z, pred, resid, resid*resid)),
+                       fmt="%r", delimiter="\t")
+
+
+args, unk = parser.parse_known_args()
+
+if args.stream:
+    spool = tempfile.TemporaryFile() if args.outfile else None
+    A, res, rank, sing, m = stream_fit(read_chunks(unk, args.chunk_size), spool)
+
+    for i,a in enumerate(A):
+        print "a%d\t%f" % (i, a)
+
+    print "Sum of squared residuals: %f" % res
+    print "Rank of matrix: %d" % rank
+
+    if args.outfile:
+        print m
+        write_stream(args.outfile, spool, A, args.chunk_size)
+        spool.close()
+    sys.exit(0)
+
 Y = []
 Z = []
 n = None
 
-args, unk = parser.parse_known_args()
-
 for line in fileinput.input(unk):
     vals = [float(x) for x in line.strip().split()]
     Y.append(vals[0])
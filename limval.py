@@ -5,7 +5,13 @@
 # Time-stamp: <2016-12-22 11:37:42 yuki>
 #
 # Description: Script to analyse the behaviour of gdt-g score w.r.t.
-# cutoff values. Dir's are set for use on spencer.
+# cutoff values. Dir's are set for use on spencer. Each dir may
+# also be a tar archive of the files (see protarchive.py).
+# With several cutoff values, all are computed from one growth of
+# each window (see gdtcdp.computegdtg_multi), and the output is a
+# decoy x cutoff table with a header line of cutoff values.
+# Decoys are loaded one at a time, grouped by target, and only the
+# current target is kept in memory (see iterpairs).
 #
 # Author: Yuki Koyanagi
 # History:
@@ -14,6 +20,8 @@
 import os
 import argparse
 import gdtcdp
+import protcache
+import protarchive
 
 tdir = os.path.abspath('data/casp10/targets')
 #ddir = os.path.abspath('data/casp10/decoytest')
@@ -22,25 +30,100 @@ tertdir = os.path.abspath('../tertiary/data/20151102/casp10')
 seqf = 'casp10.seqlen.txt'
 
 
-def addprots(d, tertd, seqf):
-    res = []
-    for f in os.listdir(d):
-        n, _ = os.path.splitext(f)
-        prot = gdtcdp.Protein(name=n)
-        prot.from_file(os.path.join(d, f))
-        prot.add_tertiary_interactions(os.path.join(tertd, f))
-        prot.addresidueids(seqf)
-        res.append(prot)
-    return res
+def addprots(d, tertd, seqf, cachedir=None):
+    return list(iterprots(d, tertd, seqf, cachedir))
+
+
+def iterprots(d, tertd, seqf, cachedir=None):
+    """
+    Yields the proteins in directory or archive d, loading them one
+    at a time.
+    """
+    # temporary files from an archive are not worth caching
+    pcache = None if protarchive.isarchive(d) else cachedir
+    for f, path in protarchive.files(d):
+        yield loadprot(f, path, tertd, seqf, pcache, cachedir)
+
+
+def loadprot(f, path, tertd, seqf, pcache=None, cachedir=None):
+    """
+    Returns the protein in file path (named f), with tertiary
+    interactions and residue ids. pcache is the cache dir for path,
+    and cachedir for the tertiary file.
+    """
+    n, _ = os.path.splitext(f)
+    prot = gdtcdp.Protein(name=n)
+    protcache.from_file(prot, path, pcache)
+    protcache.add_tertiary_interactions(prot, os.path.join(tertd, f),
+                                        cachedir)
+    prot.addresidueids(seqf)
+    return prot
+
+
+def iterpairs(td, dd, tertd, seqf, cachedir=None):
+    """
+    Yields (target, decoy) for each decoy in directory or archive dd
+    which has a target in td. Decoys are loaded one at a time and
+    grouped by target name, and each target is loaded when its
+    first decoy is read and dropped after its last, so only the
+    current target and decoy are in memory. If td is an archive,
+    which cannot be read per file, all targets are loaded first.
+    """
+    if protarchive.isarchive(td):
+        targets = targetindex(iterprots(td, tertd, seqf, cachedir))
+        gettarget = targets.get
+    else:
+        # only list the target dir here
+        paths = dict((protarchive.targetname(f), (f, path))
+                     for f, path in protarchive.files(td))
+
+        def gettarget(name):
+            if name not in paths:
+                return None
+            f, path = paths[name]
+            return loadprot(f, path, tertd, seqf, cachedir, cachedir)
+    dcache = None if protarchive.isarchive(dd) else cachedir
+    for name, group in protarchive.groupbytarget(protarchive.files(dd)):
+        target = gettarget(name)
+        if target is None:
+            continue
+        for f, path in group:
+            yield target, loadprot(f, path, tertd, seqf, dcache, cachedir)
+
+
+def targetindex(tprots):
+    """
+    Returns a dict {target name: target}. If names repeat, the last
+    target is used.
+    """
+    return dict((prot.name, prot) for prot in tprots)
+
+
+def pairs(tprots, dprots):
+    """
+    Yields (target, decoy) for each decoy in dprots with a target in
+    tprots.
+    """
+    targets = targetindex(tprots)
+    for decoy in dprots:
+        target = targets.get(decoy.name.split('_')[0])
+        if target is not None:
+            yield target, decoy
 
 
 def getgdts(tprots, dprots, lim, out=None):
+    return writegdts(pairs(tprots, dprots), lim, out)
+
+
+def writegdts(pairs, lim, out=None):
+    """
+    Writes the GDT-G scores for cutoff lim of (target, decoy) pairs,
+    or, if lim is a list, a decoy x cutoff table (see getgdtsweep).
+    """
+    if isinstance(lim, list):
+        return getgdtsweep(pairs, lim, out)
     res = {}
-    for decoy in dprots:
-        dname = decoy.name
-        for prot in tprots:
-            if prot.name == decoy.name.split('_')[0]:
-                target = prot
+    for target, decoy in pairs:
         res[decoy.name] = gdtcdp.computegdtg(target, decoy, lim)
     if out:
         with open(out, 'w') as outf:
@@ -51,13 +134,39 @@ def getgdts(tprots, dprots, lim, out=None):
         print '{}\t{}'.format(d, res[d])
 
 
+def getgdtsweep(pairs, lims, out=None):
+    """
+    Computes GDT-G scores of each (target, decoy) pair for all cutoff
+    values in lims, and writes a table with one row per decoy (in the
+    order of pairs) and one column per cutoff value.
+    """
+    lines = ['\t'.join(['decoy'] + [str(lim) for lim in lims])]
+    for target, decoy in pairs:
+        gdts = gdtcdp.computegdtg_multi(target, decoy, lims)
+        lines.append('\t'.join([decoy.name] + [str(g) for g in gdts]))
+    if out:
+        with open(out, 'w') as outf:
+            outf.write('\n'.join(lines))
+        return
+    for line in lines:
+        print line
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('lim', type=int)
+    parser.add_argument('lim', type=int, nargs='+',
+                        help='Cutoff value, or several values to '
+                        'compute in one sweep.')
     parser.add_argument('-o', '--output')
+    parser.add_argument('-t', '--target-dir', default=tdir,
+                        help='Target directory or archive.')
+    parser.add_argument('-d', '--decoy-dir', default=ddir,
+                        help='Decoy directory or archive.')
+    parser.add_argument('--cache-dir',
+                        help='Directory for cached parsed proteins.')
     args = parser.parse_args()
     
-    tprots = addprots(tdir, tertdir, seqf)
-    dprots = addprots(ddir, tertdir, seqf)
-
-    getgdts(tprots, dprots, args.lim, args.output)
+    lim = args.lim[0] if len(args.lim) == 1 else args.lim
+    writegdts(iterpairs(args.target_dir, args.decoy_dir, tertdir, seqf,
+                        args.cache_dir),
+              lim, args.output)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# File: protarchive.py
+#
+# Description: Read target, decoy and tertiary files directly from
+# (compressed) tar archives such as sample_data/candidates.tar.bz2,
+# without extracting them. Archives are read in a single sequential
+# decompression pass. cdp only reads from files, so each member is
+# written to a temporary file while it is being loaded, and removed
+# again before the next one is read.
+# Methods:
+#  isarchive: Is the path a tar archive?
+#  members: Yield (file name, contents) of all files in an archive
+#  asfile: Context manager giving a temporary file with given contents
+#  files: Yield (file name, path) for a directory or an archive
+#  targetname: Target name of a target or decoy file name
+#  groupbytarget: Group (file name, ...) items by target name
+#
+
+import os
+import shutil
+import tarfile
+import tempfile
+from contextlib import closing, contextmanager
+from itertools import groupby
+
+
+def isarchive(path):
+    """
+    Returns True if path is a (possibly compressed) tar archive.
+    """
+    return os.path.isfile(path) and tarfile.is_tarfile(path)
+
+
+def members(archive):
+    """
+    Yields (file name, contents) for each regular file in archive, in
+    archive order. Directories in member names are dropped.
+    """
+    with closing(tarfile.open(archive, 'r|*')) as tar:
+        for info in tar:
+            if info.isfile():
+                yield (os.path.basename(info.name),
+                       tar.extractfile(info).read())
+
+
+@contextmanager
+def asfile(name, data):
+    """
+    Writes data to a temporary file called name, and yields its path.
+    The file is removed on exit.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, name)
+        with open(path, 'wb') as outf:
+            outf.write(data)
+        yield path
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def files(path):
+    """
+    Yields (file name, path) for each file in path, which is either a
+    directory or a tar archive. Directory listings are sorted. For
+    archives the path is a temporary file which is only valid until
+    the next item is requested.
+    """
+    if isarchive(path):
+        for name, data in members(path):
+            with asfile(name, data) as fn:
+                yield name, fn
+    else:
+        for name in sorted(os.listdir(path)):
+            yield name, os.path.join(path, name)
+
+
+def targetname(fname):
+    """
+    Returns the target name for a target or decoy file name, e.g.
+    'T0644' for both 'T0644.txt' and 'T0644_024_1.txt'.
+    """
+    return os.path.splitext(fname)[0].split('_')[0]
+
+
+def groupbytarget(items):
+    """
+    Groups an iterable of tuples (file name, ...) by target name as
+    they arrive. Yields (target name, group iterator). Like
+    itertools.groupby, a target only forms one group if its files
+    are adjacent, as in an archive sorted by name.
+    """
+    return groupby(items, key=lambda item: targetname(item[0]))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# File: protcache.py
+#
+# Description: On-disk cache of parsed cdp protein files. The bonds
+# added by cdp.Protein.from_file (H-bonds, with lengths, clusters,
+# flags, residues and SO3 matrices) and by add_tertiary_interactions
+# (tertiary bonds with VDW distances) are stored in a binary pickle
+# per input file, and are added to the protein with add_Hbond and
+# add_tert on later runs instead of parsing the file again.
+# A cache entry is keyed by the absolute path of the input file and
+# is invalidated when the file's mtime or size changes.
+# Methods:
+#  from_file: Cached prot.from_file(fn)
+#  add_tertiary_interactions: Cached prot.add_tertiary_interactions(fn)
+#
+# Usage: With cachedir=None the cache is bypassed and the cdp
+# methods are called directly.
+#
+
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+
+# Change when the layout of cached records changes
+version = 1
+
+
+def from_file(prot, fn, cachedir=None):
+    """
+    Adds the H-bonds in cdp file fn to prot, as prot.from_file(fn).
+    """
+    def parse():
+        old = set(id(hb) for hb in prot.Hbonds)
+        prot.from_file(fn)
+        return [(hb.linenumber, hb.donor, hb.accptr, hb.length,
+                 hb.cluster, hb.flags, hb.residues, hb.so3matrix)
+                for hb in prot.Hbonds if id(hb) not in old]
+
+    for rec in load(fn, cachedir, 'Hbonds', (), parse):
+        prot.add_Hbond(*rec)
+
+
+def add_tertiary_interactions(prot, fn, cachedir=None, **kwargs):
+    """
+    Adds the tertiary bonds in file fn to prot, as
+    prot.add_tertiary_interactions(fn, **kwargs).
+    """
+    def parse():
+        old = set(id(tb) for tb in prot.Tbonds)
+        prot.add_tertiary_interactions(fn, **kwargs)
+        return [(tb.linenumber, tb.donor, tb.accptr, tb.d_VDW)
+                for tb in prot.Tbonds if id(tb) not in old]
+
+    for rec in load(fn, cachedir, 'Tbonds',
+                    tuple(sorted(kwargs.items())), parse):
+        prot.add_tert(*rec)
+
+
+def load(fn, cachedir, kind, opts, parse):
+    """
+    Returns the list of bond records of the given kind for file fn,
+    from the cache if it is up to date, and otherwise by calling
+    parse() and storing its result. When parse() is called, the
+    bonds are already added to the protein and an empty list is
+    returned.
+    """
+    if cachedir is None:
+        parse()
+        return []
+    path = os.path.abspath(fn)
+    st = os.stat(path)
+    stamp = (version, path, kind, opts, st.st_mtime, st.st_size)
+    key = hashlib.sha1(repr(stamp[:4])).hexdigest()
+    cachef = os.path.join(cachedir, key + '.pkl')
+    try:
+        with open(cachef, 'rb') as inf:
+            cstamp, recs = pickle.load(inf)
+        if cstamp == stamp:
+            return recs
+    except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+        pass  # missing or unreadable entry; parse again
+
+    recs = parse()
+    try:
+        os.makedirs(cachedir)
+    except OSError:
+        if not os.path.isdir(cachedir):
+            raise
+    # Write to a temporary file first so that concurrent runs never
+    # see a partial entry
+    fd, tmpf = tempfile.mkstemp(dir=cachedir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as outf:
+        pickle.dump((stamp, recs), outf, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpf, cachef)
+    return []